@@ -0,0 +1,99 @@
+# -----------------------------------------------------------
+# Lookup of the authority codes in finalauthority_simple.csv
+# Only the codes and dates are kept, in a plain dictionary,
+# which is saved to a binary snapshot for fast start of the next runs
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import os
+import pickle
+
+from czech_translations_index import file_signature
+
+# version of the snapshot layout, snapshot with a different version is ignored
+SNAPSHOT_VERSION = 1
+
+
+class AuthorityResolver:
+    """Resolves authority codes (column 'nkc_id') to author's birth and death years (column 'cz_dates').
+    The table is loaded on the first lookup, from the snapshot if it is up to date.
+    Counts hits (code found) and misses (code not in the table).
+    """
+
+    def __init__(self, path, snapshot_path=None):
+        self.path = path
+        if snapshot_path is None:
+            snapshot_path = os.path.splitext(path)[0] + '.pickle'
+        self.snapshot_path = snapshot_path
+        self._dates = None
+        # future of the table loaded in the background, see prefetch()
+        self._pending = None
+        self.hits = 0
+        self.misses = 0
+
+    def _read_snapshot(self, signature):
+        """Returns dictionary from the snapshot, None if the snapshot is missing or out of date."""
+        try:
+            with open(self.snapshot_path, 'rb') as snapshot:
+                data = pickle.load(snapshot)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if data.get('version') != SNAPSHOT_VERSION or data.get('signature') != signature:
+            return None
+        return data['dates']
+
+    def _write_snapshot(self, signature, dates):
+        tmp_path = self.snapshot_path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'wb') as snapshot:
+            pickle.dump({'version': SNAPSHOT_VERSION, 'signature': signature, 'dates': dates}, snapshot,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self):
+        """Loads code:dates dictionary from the snapshot or from the csv file."""
+        signature = file_signature(self.path)
+        dates = self._read_snapshot(signature)
+        if dates is None:
+            # pandas is imported only when the snapshot is out of date
+            import pandas as pd
+            table = pd.read_csv(self.path, usecols=['nkc_id', 'cz_dates'], dtype=str)
+            # first row with the code is used
+            table = table.dropna(subset=['nkc_id']).drop_duplicates('nkc_id')
+            dates = dict(zip(table['nkc_id'], table['cz_dates'].astype(str)))
+            self._write_snapshot(signature, dates)
+        self._dates = dates
+        return dates
+
+    def prefetch(self, executor):
+        """Loads the table in the executor (e.g. in a thread), the first lookup waits for it."""
+        self._pending = executor.submit(self.load)
+
+    @property
+    def dates_by_code(self):
+        if not self._pending is None:
+            (pending, self._pending) = (self._pending, None)
+            pending.result()
+        if self._dates is None:
+            self.load()
+        return self._dates
+
+    def __contains__(self, code):
+        return code in self.dates_by_code
+
+    def dates(self, code):
+        """Returns birth (and death) year of the author with the code, None if the code is unknown."""
+        dates = self.dates_by_code.get(code)
+        if dates is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return dates
+
+    def resolve(self, codes):
+        """Returns Series with dates for Series of codes.
+        Every distinct code is looked up only once."""
+        resolved = {code: self.dates(code) for code in codes.dropna().unique()}
+        return codes.map(resolved)
+
+    def stats(self):
+        return 'authority codes: %d found, %d not found' % (self.hits, self.misses)
@@ -0,0 +1,298 @@
+# -----------------------------------------------------------
+# Benchmark of the conversion from the table to the marc file
+# Generates synthetic tables, Czech translations file and authority table,
+# converts them the same way as the converter (validation, output sinks)
+# and reports time, throughput and peak memory of every stage
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from pymarc import Record
+from pymarc.field import Field
+import pandas as pd
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import marc_bibliografie_prekladu_it as converter
+from authority import AuthorityResolver
+from czech_translations_index import CzechTranslationsIndex, normalize_key
+from id_registry import IdRegistry
+import parsing
+from reporting import setup_logging
+from sinks import SINKS, Sinks
+
+# numbers of rows of the benchmarked tables
+SIZES = [1000, 10000, 100000]
+# columns of Bibliografie_prekladu.csv
+COLUMNS = ['Číslo záznamu', 'Typ záznamu', 'typ díla (celé dílo, úryvek, antologie, souborné dílo)',
+           'Je součást čeho (číslo záznamu)', 'Autor/ka + kód autority', 'Překladatel/ka',
+           'Název díla dle titulu (v příslušném písmu)', 'Údaje o odpovědnosti a další informace',
+           'Původní název', 'Údaje o zprostředkovacím díle', 'Údaje o časopiseckém vydání',
+           'Město vydání, země vydání, nakladatel', 'Rok', 'ISBN', 'Jazyk díla', 'Výchozí jazyk ',
+           'Zprostředkovací jazyk', 'Počet stran', 'Zdroj či odkaz']
+
+SURNAMES = ['Hrabal', 'Čapek', 'Kundera', 'Havel', 'Seifert', 'Němcová', 'Hašek', 'Škvorecký', 'Klíma', 'Holan',
+            'Neruda', 'Mácha', 'Erben', 'Vančura', 'Weil', 'Fuks', 'Körner', 'Topol', 'Hakl', 'Viewegh']
+NAMES = ['Bohumil', 'Karel', 'Milan', 'Václav', 'Jaroslav', 'Božena', 'Josef', 'Ivan', 'Vladimír', 'Jan']
+WORDS = ['válka', 'mloky', 'vlaky', 'žert', 'osud', 'život', 'sen', 'dům', 'noc', 'řeka', 'hrad', 'pole', 'kniha']
+TRANSLATORS = ['Rossi, Mario', 'Bianchi, Anna', 'Verdi, Giuseppe', 'Neri, Laura', 'Ricci, Paolo', 'Marino, Giulia',
+               'Greco, Luca', 'Bruno, Sara', 'Gallo, Marco', 'Conti, Elena']
+PUBLICATIONS = ['Milano (Itálie): Feltrinelli', 'Roma (Itálie): Einaudi', 'Torino (Itálie): Einaudi',
+                'Praha (Česká republika): Odeon', '? (Itálie): [s. n.]', 'Firenze (Itálie): Giunti']
+ITALIAN_TITLES = ['Il treno', 'La guerra', "L'amore", 'Scherzo', 'Gli anni', 'Un sogno', 'Le notti', 'Il castello']
+MAGAZINES = ['Belfagor', 'Il Ponte', 'Linea d\'ombra', 'Paragone']
+
+
+class SyntheticData:
+    """Synthetic authors and their works shared by the table, Czech translations file and authority table"""
+
+    def __init__(self, seed, authors=500, works_per_author=8):
+        self.random = random.Random(seed)
+        self.authors = []
+        for i in range(authors):
+            name = '%s, %s' % (self.random.choice(SURNAMES) + ('' if i < len(SURNAMES) else str(i)), self.random.choice(NAMES))
+            code = 'jk%08d' % (1000000 + i)
+            born = self.random.randint(1800, 1960)
+            works = [' '.join(self.random.sample(WORDS, self.random.randint(1, 3))).capitalize() for w in range(works_per_author)]
+            self.authors.append((name, code, '%d-%d' % (born, born + self.random.randint(30, 90)), works))
+
+    def write_translations(self, path):
+        """Writes Czech translations file with field 595 for every work"""
+        with open(path, 'wb') as out:
+            for i, (name, code, dates, works) in enumerate(self.authors):
+                for j, work in enumerate(works):
+                    record = Record(to_unicode=True, force_utf8=True)
+                    record.add_ordered_field(Field(tag='595', indicators=['1', '2'], subfields=['a', name + ',',
+                                                                                                 't', work + '.',
+                                                                                                 '1', 'ubc%09d' % (i * 100 + j)]))
+                    out.write(record.as_marc())
+
+    def write_authority(self, path):
+        """Writes authority table with all authors (without a few, so some codes are not found)"""
+        authors = [a for i, a in enumerate(self.authors) if i % 50 != 49]
+        pd.DataFrame({'nkc_id': [code for (name, code, dates, works) in authors],
+                      'cz_dates': [dates for (name, code, dates, works) in authors]}).to_csv(path)
+
+    def row(self, number, record_type, work_type, part_of=None):
+        r = self.random
+        (name, code, dates, works) = r.choice(self.authors)
+        if r.random() < 0.05:
+            author = name
+        else:
+            author = '%s (%s)' % (name, code)
+        if r.random() < 0.1:
+            original = r.choice(['originál neznámý', 'Originál neexistuje'])
+        elif r.random() < 0.2:
+            # work that is not in the Czech translations file
+            original = 'Nové dílo %d' % number
+        else:
+            original = r.choice(works)
+        title = r.choice(ITALIAN_TITLES)
+        if r.random() < 0.3:
+            title += ' : romanzo'
+        return {'Číslo záznamu': number,
+                'Typ záznamu': record_type,
+                'typ díla (celé dílo, úryvek, antologie, souborné dílo)': work_type,
+                'Je součást čeho (číslo záznamu)': part_of,
+                'Autor/ka + kód autority': author,
+                'Překladatel/ka': ' § '.join(r.sample(TRANSLATORS, r.randint(1, 3))) if r.random() < 0.9 else None,
+                'Název díla dle titulu (v příslušném písmu)': title,
+                'Údaje o odpovědnosti a další informace': r.choice([None, None, 'prefazione di Angelo Maria Ripellino']),
+                'Původní název': original,
+                'Údaje o zprostředkovacím díle': r.choice([None] * 9 + ['Der Krieg mit den Molchen']),
+                'Údaje o časopiseckém vydání': None,
+                'Město vydání, země vydání, nakladatel': ' § '.join(r.sample(PUBLICATIONS, 1 if r.random() < 0.9 else 2)),
+                'Rok': r.randint(1920, 2022),
+                'ISBN': r.choice([None, '978-88-07-%05d-%d' % (r.randint(0, 99999), r.randint(0, 9))]),
+                'Jazyk díla': 'ita italsky',
+                'Výchozí jazyk ': 'cze česky',
+                'Zprostředkovací jazyk': r.choice([None] * 9 + ['ger německy']),
+                'Počet stran': r.choice([None, str(r.randint(20, 600)), '%d p.' % r.randint(20, 600)]),
+                'Zdroj či odkaz': r.choice([None, 'SBN OPAC', 'Bibliografie ČLB'])}
+
+    def table(self, size):
+        """Returns table with 'size' rows: books, articles and collective works with their parts"""
+        rows = []
+        while len(rows) < size:
+            number = len(rows) + 1
+            kind = self.random.random()
+            if kind < 0.55:
+                rows.append(self.row(number, 'kniha', self.random.choice(['celé dílo', 'antologie'])))
+            elif kind < 0.8:
+                row = self.row(number, 'článek v časopise', 'úryvek')
+                row['Údaje o časopiseckém vydání'] = '%s, %d, č. %d, s. %d' % (self.random.choice(MAGAZINES), row['Rok'],
+                                                                              self.random.randint(1, 12), self.random.randint(1, 200))
+                row['Město vydání, země vydání, nakladatel'] = None
+                rows.append(row)
+            else:
+                rows.append(self.row(number, 'kniha', 'souborné dílo'))
+                for i in range(min(self.random.randint(2, 8), size - len(rows))):
+                    part = self.row(len(rows) + 1, 'část knihy', 'celé dílo', number)
+                    if self.random.random() < 0.7:
+                        # part has the author of the collective work
+                        part['Autor/ka + kód autority'] = None
+                    rows.append(part)
+        return pd.DataFrame(rows[:size], columns=COLUMNS)
+
+
+# memoized functions, cleared before every conversion so each one starts from empty caches
+MEMOIZED = [parsing.parse_author, parsing.natural_name, parsing.parse_names, parsing.parse_publication,
+            parsing.nonfiling_characters, parsing.first_token, normalize_key]
+
+
+class Stages:
+    """Cumulative time of the benchmark stages.
+    With trace_memory, also the peak memory allocated by Python during every stage (tracemalloc must be started)."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.memory = {}
+
+    def start(self):
+        """Starts measuring of the next stage, returns its start time"""
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        return time.perf_counter()
+
+    def add(self, stage, start):
+        """Adds time since 'start' to the stage, with trace_memory also keeps its highest peak"""
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            self.memory[stage] = max(self.memory.get(stage, 0.0), peak)
+
+
+def convert(paths, seed, formats, stages, verify=False):
+    """Converts the synthetic table in paths the same way as the converter's main():
+    valid rows are loaded by load_valid_rows() and records are written by Sinks.
+    Returns tuple (bytes of marc written, records that differ from pymarc)."""
+    for function in MEMOIZED:
+        function.cache_clear()
+    start = stages.start()
+    converter.translations_index = CzechTranslationsIndex(paths['translations'])
+    converter.translations_index.connection
+    converter.finalauthority = AuthorityResolver(paths['authority'])
+    converter.finalauthority.load()
+    converter.id_registry = IdRegistry(None, seed=seed, known_ids=converter.translations_index.identifiers)
+    converter.id_registry.load_known()
+    stages.add('lookups', start)
+
+    start = stages.start()
+    rows = converter.load_valid_rows(paths['table'], 'quarantine', paths['quarantine'])
+    record_index = converter.RecordIndex(rows)
+    stages.add('table', start)
+
+    written = 0
+    mismatches = 0
+    sinks = Sinks(paths['output'], formats)
+    try:
+        for row in rows:
+            start = stages.start()
+            record = converter.create_record(row, record_index)
+            stages.add('build', start)
+            if record is None:
+                continue
+            start = stages.start()
+            marc = record.as_marc()
+            stages.add('serialize', start)
+            start = stages.start()
+            sinks.write(marc)
+            stages.add('write', start)
+            written += len(marc)
+            if verify and record.as_pymarc().as_marc() != marc:
+                mismatches += 1
+                print('Record %s differs from pymarc' % row.number)
+    except Exception:
+        sinks.discard()
+        raise
+    start = stages.start()
+    sinks.close()
+    stages.add('write', start)
+    return (written, mismatches)
+
+def run(size, directory, seed, verify=False, formats=('marc',), memory=True):
+    """Converts synthetic table with 'size' rows, returns dictionary with results of all stages.
+    With verify, every record is also serialized by pymarc and compared with the record builder's output.
+    With memory, the table is converted once more with tracemalloc to measure peak memory of every stage,
+    tracing slows allocations, so times are taken from the first conversion without it."""
+    data = SyntheticData(seed)
+    paths = {'table': os.path.join(directory, 'table_%d.csv' % size),
+             'translations': os.path.join(directory, 'czech_translations_%d.mrc' % size),
+             'authority': os.path.join(directory, 'finalauthority_%d.csv' % size),
+             'quarantine': os.path.join(directory, 'quarantine_%d.csv' % size),
+             'output': os.path.join(directory, 'marc_%d.mrc' % size)}
+    data.table(size).to_csv(paths['table'])
+    data.write_translations(paths['translations'])
+    data.write_authority(paths['authority'])
+
+    stages = Stages()
+    (written, mismatches) = convert(paths, seed, formats, stages, verify)
+    if memory:
+        traced = Stages(trace_memory=True)
+        tracemalloc.start()
+        try:
+            convert(paths, seed, formats, traced)
+        finally:
+            tracemalloc.stop()
+        stages.memory = traced.memory
+
+    total = sum(stages.seconds.values())
+    result = {'rows': size,
+            'bytes': written,
+            'total_seconds': total,
+            'rows_per_second': size / total,
+            'stages': {stage: {'seconds': seconds,
+                               'rows_per_second': size / seconds if seconds else None,
+                               'peak_memory_mb': stages.memory.get(stage)}
+                       for stage, seconds in stages.seconds.items()}}
+    if verify:
+        result['pymarc_mismatches'] = mismatches
+    return result
+
+def report(result):
+    print('%d rows, %.2f s, %.0f rows/s, %.1f MB written' % (result['rows'], result['total_seconds'],
+                                                            result['rows_per_second'], result['bytes'] / 2 ** 20))
+    if 'pymarc_mismatches' in result:
+        print('  %d records differ from pymarc' % result['pymarc_mismatches'])
+    for stage, values in result['stages'].items():
+        memory = '' if values['peak_memory_mb'] is None else '%8.1f MB peak' % values['peak_memory_mb']
+        rate = '' if values['rows_per_second'] is None else '%10.0f rows/s' % values['rows_per_second']
+        print('  %-10s %8.3f s %s %s' % (stage, values['seconds'], rate, memory))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the conversion on synthetic tables')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of rows of the tables (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic data (default: %(default)s)')
+    parser.add_argument('--json', default=None, help='also save results to this JSON file, for comparing runs')
+    parser.add_argument('--keep', default=None, help='directory for the generated files (default: temporary directory)')
+    parser.add_argument('--verify', action='store_true',
+                        help='compare every record with the same record serialized by pymarc (slow)')
+    parser.add_argument('--format', nargs='+', choices=list(SINKS), default=['marc'], dest='formats',
+                        help='output formats written in one pass (default: marc)')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                        help="don't convert the tables again to measure peak memory of the stages")
+    args = parser.parse_args()
+    # problems of the synthetic tables are counted, not logged row by row
+    setup_logging(logging.ERROR)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.keep or tmp
+        os.makedirs(directory, exist_ok=True)
+        for size in args.sizes:
+            result = run(size, directory, args.seed, args.verify, args.formats, args.memory)
+            report(result)
+            results.append(result)
+    if not args.json is None:
+        with open(args.json, 'w', encoding='utf_8') as out:
+            json.dump(results, out, indent=2)
+
+if __name__ == '__main__':
+    main()
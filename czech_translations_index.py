@@ -0,0 +1,336 @@
+# -----------------------------------------------------------
+# Persistent index of the Czech translations MARC file
+# Keeps author - work:id pairs and all identifiers from field 595
+# in a SQLite file, so the .mrc file is parsed only when it changes
+# Works are matched exactly, by normalized keys (without diacritics and punctuation)
+# or by similarity of their trigrams
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from collections import Counter
+from functools import lru_cache
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import unicodedata
+
+# version of the index layout, index with a different version is rebuilt
+INDEX_VERSION = '2'
+# minimal similarity of trigrams of fuzzy matched authors and works, 1 turns fuzzy matching off,
+# fuzzy matching is opt-in, similar titles are often different works (e.g. 'Básně I' and 'Básně II')
+MATCH_THRESHOLD = 1.0
+# characters replaced by space in the normalized keys
+PUNCTUATION = re.compile(r'[\W_]+')
+# arabic or roman number in the normalized key (volume, part), fuzzy matched works must have the same numbers
+NUMBER = re.compile(r'\d+|[ivxlcdm]+')
+
+log = logging.getLogger(__name__)
+
+def file_signature(path):
+    """Returns size and modification time of the file as strings."""
+    stat = os.stat(path)
+    return (str(stat.st_size), str(stat.st_mtime_ns))
+
+def file_hash(path):
+    """Returns sha1 hash of the file's content."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+@lru_cache(maxsize=None)
+def normalize_key(text):
+    """Returns text lower-cased, without diacritics, punctuation and repeated whitespaces,
+    e.g. 'Čapek, Karel' -> 'capek karel'"""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return ' '.join(PUNCTUATION.sub(' ', text).split())
+
+def numbers(key):
+    """Returns set of the words of the normalized key that are arabic or roman numbers"""
+    return frozenset(word for word in key.split() if NUMBER.fullmatch(word))
+
+def trigrams(key):
+    """Returns set of trigrams of the key, the beginning and the end of the key are padded with spaces"""
+    padded = '  ' + key + ' '
+    return frozenset(padded[position:position + 3] for position in range(len(padded) - 2))
+
+def similarity(first, second):
+    """Dice coefficient of two sets of trigrams, 1 for the same sets, 0 for sets without common trigram"""
+    if not first or not second:
+        return 0.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+class TrigramIndex:
+    """Finds the most similar key among many keys by their common trigrams.
+    A key similar at least by the threshold must share one of the rarest trigrams of the looked up key
+    (prefix filtering), so only keys containing them are compared."""
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.grams = [trigrams(key) for key in self.keys]
+        # trigram: positions of the keys that contain it
+        self.postings = {}
+        for position, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(position)
+
+    def best(self, key, threshold):
+        """Returns tuple (most similar key, similarity), (None, 0.0) if no key is similar at least by threshold"""
+        grams = trigrams(key)
+        # similar key has at least this many common trigrams
+        overlap = max(1, math.ceil(threshold * len(grams) / (2 - threshold) - 1e-9))
+        rarest = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(grams) - overlap + 1]:
+            candidates.update(self.postings.get(gram, ()))
+        (best_key, best_similarity) = (None, 0.0)
+        for position in candidates:
+            score = similarity(grams, self.grams[position])
+            if score >= threshold and score > best_similarity:
+                (best_key, best_similarity) = (self.keys[position], score)
+        return (best_key, best_similarity)
+
+
+def read_595(path):
+    """Reads the Czech translations file.
+    Yields tuples (author, work, id) from field 595, author and work are lower-cased,
+    work is None if the field has no subfield 't'."""
+    # pymarc is needed only when the index is built
+    from pymarc import MARCReader
+    with open(path, 'rb') as data:
+        reader = MARCReader(data, to_unicode=True, force_utf8=True, utf8_handling="strict")
+        for record in reader:
+            if not record is None:
+                if not record['595'] is None:
+                    id = record['595']['1']
+                    author = record['595']['a']
+                    author = author[0:len(author)-1]
+                    work = record['595']['t']
+                    if not work is None:
+                        if work[-1] == '.':
+                            work = work[0:len(work)-1]
+                        work = work.lower()
+                    yield (author.lower(), work, id)
+
+
+class CzechTranslationsIndex:
+    """Index of field 595 of the Czech translations file stored in SQLite.
+    The index is built on the first lookup and rebuilt when the size, modification time
+    or hash of the source file changes.
+    'threshold' is the minimal similarity of fuzzy matched authors and works (see match()).
+    """
+
+    def __init__(self, source, index_path=None, threshold=MATCH_THRESHOLD):
+        self.source = source
+        self.threshold = threshold
+        if index_path is None:
+            index_path = os.path.splitext(source)[0] + '.sqlite'
+        self.index_path = index_path
+        self._connection = None
+        self._pid = None
+        # future of the index prepared in the background, see prefetch()
+        self._pending = None
+        # author:{work:id} dictionaries of already looked up authors
+        self._works = {}
+        # the same for the normalized keys of authors and works
+        self._works_by_key = {}
+        # trigrams of the normalized keys of all authors, built on the first fuzzy match
+        self._authors = None
+        # (author, work): (id, kind of match) of already matched works
+        self._matches = {}
+        # number of matches of every kind: exact, normalized, fuzzy, none
+        self.match_stats = Counter()
+
+    @property
+    def connection(self):
+        """Opens the index lazily.
+        Every process gets its own connection, SQLite connections can't be shared after fork.
+        If the index is prepared in the background, the first lookup waits for it."""
+        if not self._pending is None:
+            (pending, self._pending) = (self._pending, None)
+            pending.result()
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = self._open()
+            self._pid = os.getpid()
+        return self._connection
+
+    def prefetch(self, executor):
+        """Checks the index and rebuilds it if it is out of date in the executor (e.g. in another process),
+        while other inputs are loaded. Only the first lookup waits for it."""
+        self._pending = executor.submit(prepare_index, self.source, self.index_path)
+
+    def _read_meta(self, connection):
+        """Returns meta data saved in the index, empty dictionary if the index is unusable."""
+        try:
+            return dict(connection.execute('SELECT key, value FROM meta').fetchall())
+        except sqlite3.DatabaseError:
+            return {}
+
+    def is_valid(self, connection):
+        """Checks whether the index was built from the current version of the source file.
+        If only the modification time changed and the content is the same, the index stays valid."""
+        meta = self._read_meta(connection)
+        if meta.get('version') != INDEX_VERSION:
+            return False
+        (size, mtime) = file_signature(self.source)
+        if meta.get('size') != size:
+            return False
+        if meta.get('mtime') == mtime:
+            return True
+        if meta.get('sha1') != file_hash(self.source):
+            return False
+        with connection:
+            connection.execute("UPDATE meta SET value = ? WHERE key = 'mtime'", (mtime,))
+        return True
+
+    def _open(self):
+        if os.path.exists(self.index_path):
+            connection = sqlite3.connect(self.index_path)
+            if self.is_valid(connection):
+                return connection
+            connection.close()
+        self.build()
+        return sqlite3.connect(self.index_path)
+
+    def build(self):
+        """Parses the source file and writes the index.
+        Index is written to a temporary file first and then renamed,
+        so other processes never see half-written index."""
+        log.info('Building index of %s', self.source)
+        (size, mtime) = file_signature(self.source)
+        sha1 = file_hash(self.source)
+        tmp_path = self.index_path + '.%d.tmp' % os.getpid()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        with connection:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE works (author TEXT, work TEXT, id TEXT, PRIMARY KEY (author, work))')
+            connection.execute('CREATE TABLE identifiers (id TEXT PRIMARY KEY)')
+            connection.execute('CREATE TABLE normalized (author_key TEXT, work_key TEXT, id TEXT, PRIMARY KEY (author_key, work_key))')
+            entries = list(read_595(self.source))
+            # rows are inserted in batches in the order of the records,
+            # later records overwrite the earlier ones, same as updating a dictionary
+            connection.executemany('INSERT OR IGNORE INTO identifiers VALUES (?)',
+                                   [(id,) for (author, work, id) in entries if not id is None])
+            works = [(author, work, id) for (author, work, id) in entries if not work is None]
+            connection.executemany('INSERT OR REPLACE INTO works VALUES (?, ?, ?)', works)
+            connection.executemany('INSERT OR REPLACE INTO normalized VALUES (?, ?, ?)',
+                                   [(normalize_key(author), normalize_key(work), id) for (author, work, id) in works])
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', [('version', INDEX_VERSION),
+                                                                      ('source', self.source),
+                                                                      ('size', size),
+                                                                      ('mtime', mtime),
+                                                                      ('sha1', sha1)])
+        connection.close()
+        os.replace(tmp_path, self.index_path)
+        self._works = {}
+        self._works_by_key = {}
+        self._authors = None
+        self._matches = {}
+
+    def works_of(self, author):
+        """Returns dictionary work:id of all works by the (lower-cased) author.
+        Returns empty dictionary if the author is not in the index."""
+        if not author in self._works:
+            rows = self.connection.execute('SELECT work, id FROM works WHERE author = ?', (author,)).fetchall()
+            self._works[author] = dict(rows)
+        return self._works[author]
+
+    def works_by_key(self, author_key):
+        """Returns dictionary normalized work: id of all works by the author with the normalized key."""
+        if not author_key in self._works_by_key:
+            rows = self.connection.execute('SELECT work_key, id FROM normalized WHERE author_key = ?', (author_key,)).fetchall()
+            self._works_by_key[author_key] = dict(rows)
+        return self._works_by_key[author_key]
+
+    @property
+    def authors(self):
+        """Trigram index of the normalized keys of all authors"""
+        if self._authors is None:
+            keys = [key for (key,) in self.connection.execute('SELECT DISTINCT author_key FROM normalized')]
+            self._authors = TrigramIndex(keys)
+        return self._authors
+
+    def _match(self, author, work):
+        """Returns tuple (id, kind of match) of the work, id is None if the work is not found."""
+        id = self.works_of(author.lower()).get(work.lower())
+        if not id is None:
+            return (id, 'exact')
+        (author_key, work_key) = (normalize_key(author), normalize_key(work))
+        works = self.works_by_key(author_key)
+        if work_key in works:
+            return (works[work_key], 'normalized')
+        if self.threshold >= 1:
+            return (None, 'none')
+        if not works:
+            # author is written differently, e.g. with a typo
+            (author_key, author_similarity) = self.authors.best(author_key, self.threshold)
+            if author_key is None:
+                return (None, 'none')
+            works = self.works_by_key(author_key)
+            if work_key in works:
+                log.info('Fuzzy match: work %r of %r matched to author %r (similarity %.2f)', work, author, author_key, author_similarity)
+                return (works[work_key], 'fuzzy')
+        # works with different numbers are different volumes or parts, however similar they are
+        work_numbers = numbers(work_key)
+        candidates = [key for key in works if numbers(key) == work_numbers]
+        (best_work, best_similarity) = TrigramIndex(candidates).best(work_key, self.threshold)
+        if best_work is None:
+            return (None, 'none')
+        log.info('Fuzzy match: work %r of %r matched to %r (similarity %.2f)', work, author, best_work, best_similarity)
+        return (works[best_work], 'fuzzy')
+
+    def match(self, author, work):
+        """Returns id of the author's work, None if the work is not in the index.
+        Tries the exact (lower-cased) author and work, then their normalized keys
+        and then the most similar author and work with similarity at least self.threshold
+        (only if the threshold is below 1, works must have the same numbers, every fuzzy match is logged)."""
+        if not (author, work) in self._matches:
+            self._matches[(author, work)] = self._match(author, work)
+        (id, kind) = self._matches[(author, work)]
+        self.match_stats[kind] += 1
+        return id
+
+    def pop_stats(self):
+        """Returns numbers of matches and starts counting again (used in worker processes)"""
+        stats = self.match_stats
+        self.match_stats = Counter()
+        return stats
+
+    def stats(self):
+        return 'works in field 595: %d exact, %d normalized, %d fuzzy, %d not found' % (
+            self.match_stats['exact'], self.match_stats['normalized'], self.match_stats['fuzzy'], self.match_stats['none'])
+
+    def has_identifier(self, id):
+        """Checks whether id is used in the Czech translations file."""
+        return self.connection.execute('SELECT 1 FROM identifiers WHERE id = ?', (id,)).fetchone() is not None
+
+    def identifiers(self):
+        """Yields all identifiers used in the Czech translations file."""
+        for (id,) in self.connection.execute('SELECT id FROM identifiers'):
+            yield id
+
+    def close(self):
+        if not self._connection is None:
+            self._connection.close()
+            self._connection = None
+
+def prepare_index(source, index_path):
+    """Opens the index of the source file, so it is rebuilt if it is missing or out of date (run in another process)"""
+    index = CzechTranslationsIndex(source, index_path)
+    index.connection
+    index.close()
+
+
+if __name__ == '__main__':
+    # rebuilds the index of the default Czech translations file
+    index = CzechTranslationsIndex("data/czech_translations_full_18_01_2022.mrc")
+    index.build()
+    print("Index written to " + index.index_path)
@@ -0,0 +1,197 @@
+# -----------------------------------------------------------
+# Streaming pipeline from the Excel table straight to the marc file
+# Rows are read from the workbook in read-only mode, normalized in batches
+# and written to the marc file, without the intermediate CSV file
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from openpyxl import load_workbook
+import pandas as pd
+import argparse
+import logging
+import os
+
+from normalization import normalize_table, table_rows
+from parsing import isnull
+import marc_bibliografie_prekladu_it as converter
+from sinks import SINKS, Sinks, add_sharding_arguments, sharding_options
+import validation
+from reporting import Progress, add_logging_arguments, logging_level, setup_logging
+
+log = logging.getLogger(__name__)
+
+# initial table
+EXCEL = "data/Bibliografie prekladu.xlsx"
+# number of rows under the header that are not records
+HEADER_ROWS = 13
+# number of rows normalized together
+BATCH_SIZE = 1000
+
+def read_sheet(path):
+    """Yields rows of the first sheet as tuples, the first tuple is the header.
+    Workbook is read in read-only mode, so it is never loaded whole."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+def read_records(path):
+    """Yields header and then tuples (position, row) of all rows with records.
+    Skips the header rows and empty rows, same as excel_to_csv.py."""
+    rows = read_sheet(path)
+    header = list(next(rows))
+    yield header
+    number = header.index('Číslo záznamu')
+    for position, row in enumerate(rows):
+        if position < HEADER_ROWS:
+            continue
+        # row is empty, if all columns except 'Číslo záznamu' are empty
+        if all(value is None for i, value in enumerate(row) if i != number):
+            continue
+        yield (position, row)
+
+def read_batches(path, batch_size):
+    """Yields DataFrames with at most batch_size rows of the table, indexed by the position in the sheet"""
+    records = read_records(path)
+    header = next(records)
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch_frame(header, batch)
+            batch = []
+    if batch:
+        yield batch_frame(header, batch)
+
+def batch_frame(header, batch):
+    positions = [position for (position, row) in batch]
+    return pd.DataFrame([row for (position, row) in batch], columns=header, index=positions).infer_objects()
+
+def validated_batches(path, batch_size):
+    """Yields tuples (batch of the table, normalized batch, its problems) for all batches of the table"""
+    for batch in read_batches(path, batch_size):
+        normalized = normalize_table(batch)
+        # author's dates are looked up once for every authority code
+        normalized['author_dates'] = converter.finalauthority.resolve(normalized['author_code'])
+        # collective works can be in other batches, they are checked in stream_records()
+        problems = validation.validate(normalized, whole_table=False)
+        yield (batch, normalized, problems)
+
+def read_links(path, batch_size=BATCH_SIZE):
+    """First pass through the table.
+    Returns dictionary record number of the collective work: record numbers of its parts.
+    Links are read from the normalized rows without errors, same as RecordIndex,
+    so collective works don't link to the parts that are skipped."""
+    children = {}
+    for (batch, normalized, problems) in validated_batches(path, batch_size):
+        for row in table_rows(normalized.drop(validation.invalid_rows(problems))):
+            if not isnull(row.part_of):
+                children.setdefault(row.part_of, []).append(row.number)
+    return children
+
+
+class StreamingRecordIndex:
+    """Links between collective works and their parts while the table is streamed.
+    Links are read in the first pass, only rows of the collective works are kept in memory.
+    """
+
+    def __init__(self, children):
+        self.children = children
+        # record number of the collective work: its row
+        self.parents = {}
+
+    def add(self, row):
+        """Keeps the row if other rows are its parts"""
+        if row.number in self.children and not row.number in self.parents:
+            self.parents[row.number] = row
+
+    def has_row(self, number):
+        return number in self.parents
+
+    def row(self, number):
+        """Returns row of the collective work with the given number"""
+        return self.parents[number]
+
+    def parts(self, number):
+        """Returns record numbers of all parts of the collective work"""
+        return self.children.get(number, [])
+
+
+def stream_rows(path, batch_size, csv_path=None, quarantine=None):
+    """Yields normalized rows of the table without errors.
+    If csv_path is given, rows are also written to the CSV file (for debugging).
+    If quarantine is given, rows with errors are written to this CSV file."""
+    first = True
+    invalid = 0
+    for (batch, normalized, problems) in validated_batches(path, batch_size):
+        if not csv_path is None:
+            batch.to_csv(csv_path, mode='w' if first else 'a', header=first)
+            first = False
+        validation.report(problems, summary=False)
+        rows = validation.invalid_rows(problems)
+        if len(rows) > 0:
+            invalid += len(rows)
+            if not quarantine is None:
+                validation.write_quarantine(normalized, problems, list(batch.columns), quarantine, append=True)
+        yield from table_rows(normalized.drop(rows))
+    log.info('Validation: %d rows with errors skipped', invalid)
+
+def stream_records(rows, record_index):
+    """Yields records of the rows.
+    Part of the book listed before its collective work waits until the collective work is read,
+    parts whose collective work is missing or has errors are skipped."""
+    # record number of the collective work: its parts waiting for it
+    waiting = {}
+    for row in rows:
+        record_index.add(row)
+        if 'část knihy' in row.record_type and not record_index.has_row(int(row.part_of)):
+            waiting.setdefault(int(row.part_of), []).append(row)
+            continue
+        for r in [row] + waiting.pop(row.number, []):
+            record = converter.create_record(r, record_index)
+            if not record is None:
+                yield record
+    for number in sorted(waiting):
+        # collective work is missing in the table or it has errors
+        for r in waiting[number]:
+            log.error('Record %s, column %r: collective work %s is missing or has errors, skipped',
+                      r.number, 'Je součást čeho (číslo záznamu)', number)
+
+def main():
+    parser = argparse.ArgumentParser(description='Transforms the Excel table of Italian translations to a marc file')
+    parser.add_argument('--input', default=EXCEL, help='Excel table (default: %(default)s)')
+    parser.add_argument('--output', default=converter.OUT, help='marc file, other formats are written next to it (default: %(default)s)')
+    parser.add_argument('--format', nargs='+', choices=list(SINKS), default=['marc'], dest='formats',
+                        help='output formats written in one pass (default: marc)')
+    parser.add_argument('--gzip', action='store_true', help='compress all outputs with gzip')
+    add_sharding_arguments(parser)
+    parser.add_argument('--csv', default=None, help='also write the table to this CSV file (for debugging)')
+    parser.add_argument('--quarantine', default=converter.QUARANTINE,
+                        help='CSV file for rows with errors, empty to only skip them (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of rows normalized together (default: %(default)s)')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(logging_level(args))
+    sharding = sharding_options(parser, args)
+
+    record_index = StreamingRecordIndex(read_links(args.input, args.batch_size))
+    quarantine = args.quarantine or None
+    if not quarantine is None and os.path.exists(quarantine):
+        # rows of this run are appended batch by batch
+        os.remove(quarantine)
+    rows = stream_rows(args.input, args.batch_size, args.csv, quarantine)
+    # number of rows isn't known while streaming, progress is logged without ETA
+    progress = Progress(None, log, unit='records')
+    with Sinks(args.output, args.formats, args.gzip, **sharding) as sinks:
+        for record in stream_records(rows, record_index):
+            log.debug('Record:\n%s', record)
+            sinks.write(record.as_marc())
+            progress.update()
+    progress.finish()
+    log.info(converter.finalauthority.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -----------------------------------------------------------
+# Registry of identifiers generated for field 595
+# Remembers every id that is already used, so generated ids never repeat,
+# and saves the issued ids to a file, so re-runs give the same ids
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import os
+import random
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, registry file is locked only within one process
+    fcntl = None
+
+# number of candidates tried before reserve() gives up (e.g. all ids of an authority code are used)
+MAX_CANDIDATES = 100000
+
+def make_key(*parts):
+    """Creates key of the id from its parts (e.g. authority code and original title).
+    Tabs and new lines are replaced, so the key fits on one line of the registry file."""
+    return '|'.join(' '.join(str(part).split()) for part in parts)
+
+
+class IdRegistry:
+    """Set of used identifiers with atomic reservation of new ones.
+
+    Ids are saved to the file in 'path' as lines 'key<TAB>id'. An id issued for a key is
+    returned again for the same key, also in later runs.
+    With 'seed', a new id depends only on the seed and its key, so the ids don't depend
+    on the order the records are converted in.
+    'known_ids' is a function returning ids that are used elsewhere (e.g. in the Czech translations file),
+    it is called on the first reservation.
+    """
+
+    def __init__(self, path=None, seed=None, known_ids=None):
+        self.path = path
+        self.seed = seed
+        self.known_ids = known_ids
+        # module random is reseeded in forked processes, its own instance wouldn't be
+        self._random = random if seed is None else random.Random(seed)
+        # all used ids
+        self._ids = set()
+        # key:id pairs of issued ids
+        self._issued = {}
+        # how far the registry file was read
+        self._offset = 0
+        self._loaded_known = False
+        self._lock = threading.Lock()
+
+    def __contains__(self, id):
+        with self._lock:
+            self.load_known()
+            return id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load_known(self):
+        """Adds ids from 'known_ids' to the used ids, only once."""
+        if not self._loaded_known:
+            if not self.known_ids is None:
+                self._ids.update(self.known_ids())
+            self._loaded_known = True
+
+    @contextmanager
+    def _locked_file(self):
+        """Opens the registry file locked for this process.
+        Other processes using the same file wait until the lock is released."""
+        if self.path is None:
+            yield None
+            return
+        with open(self.path, 'a+', encoding='utf_8') as registry:
+            if not fcntl is None:
+                fcntl.flock(registry, fcntl.LOCK_EX)
+            try:
+                yield registry
+            finally:
+                if not fcntl is None:
+                    fcntl.flock(registry, fcntl.LOCK_UN)
+
+    def _read_new(self, registry):
+        """Reads ids that were added to the file since the last reading (also by other processes)."""
+        registry.seek(self._offset)
+        for line in registry:
+            (key, id) = line.rstrip('\n').split('\t')
+            self._ids.add(id)
+            if key:
+                self._issued[key] = id
+        self._offset = registry.tell()
+
+    def _candidates(self, candidate, key):
+        """Yields candidate ids. Seeded candidates for a key are always generated in the same order."""
+        for attempt in range(MAX_CANDIDATES):
+            if self.seed is None or key is None:
+                yield candidate(self._random)
+            else:
+                yield candidate(random.Random('%s|%s|%d' % (self.seed, key, attempt)))
+
+    def reserve(self, candidate, key=None):
+        """Returns a new unused id and marks it as used.
+        'candidate' is a function creating an id from the given random.Random.
+        If an id was already issued for 'key', returns that id.
+        Raises RuntimeError if no unused id is found among MAX_CANDIDATES candidates."""
+        with self._lock, self._locked_file() as registry:
+            self.load_known()
+            if not registry is None:
+                self._read_new(registry)
+            if not key is None and key in self._issued:
+                return self._issued[key]
+            for id in self._candidates(candidate, key):
+                if not id in self._ids:
+                    break
+            else:
+                raise RuntimeError('No unused id found in %d attempts for key %r, ids of this kind are probably used up' % (MAX_CANDIDATES, key))
+            self._ids.add(id)
+            if not key is None:
+                self._issued[key] = id
+            if not registry is None:
+                registry.seek(0, os.SEEK_END)
+                registry.write(('' if key is None else key) + '\t' + id + '\n')
+                registry.flush()
+                self._offset = registry.tell()
+            return id
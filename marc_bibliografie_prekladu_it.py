@@ -7,61 +7,88 @@
 # email charlottepanuskova@gmail.com
 # -----------------------------------------------------------
 
-from pymarc import Record, MARCReader
-import pandas as pd
-from pymarc.field import Field
+from record_builder import Record, Field
 from datetime import datetime
-import re
-import random
+import argparse
+import logging
+import os
+import sys
+from czech_translations_index import MATCH_THRESHOLD, CzechTranslationsIndex, file_signature, normalize_key
+from id_registry import IdRegistry, make_key
+from parsing import first_token, isnull, nonfiling_characters
+import parsing
+from authority import AuthorityResolver
+from reporting import Progress, add_logging_arguments, logging_level, setup_logging
+from profiling import Profiler
+from sinks import SINKS, Sinks, add_sharding_arguments, sharding_options
+# pandas and the modules using it (normalization, validation) are imported only when the table is loaded,
+# so the record builders and parsing functions can be imported without them
+
+log = logging.getLogger(__name__)
 
 # file with all czech translations and their id's 
 czech_translations="data/czech_translations_full_18_01_2022.mrc"
-# list of identifiers
-identifiers = []
-# dictionary with author - work:id pairs
-dict_author_work = {}
-
-# saves data from czech_translations file to dictionary dict_author_work  
-with open(czech_translations, 'rb') as data:
-    reader = MARCReader(data, to_unicode=True, force_utf8=True, utf8_handling="strict")
-    for record in reader:
-        if not record is None:
-            if not record['595'] is None: 
-                id = record['595']['1']
-                if not id in identifiers:
-                    identifiers.append(id)
-                author = record['595']['a']
-                author = author[0:len(author)-1]
-                work = record['595']['t']
-                if not work is None: 
-                    if work[-1] == '.':
-                        work = work[0:len(work)-1]
-                    if author.lower() in dict_author_work.keys():
-                        dict_author_work[author.lower()].update({work.lower() : id })  
-                    else:
-                        dict_author_work[author.lower()] = {work.lower() : id }
+# author - work:id pairs and identifiers from czech_translations file,
+# the file is parsed only when its index is missing or out of date
+translations_index = CzechTranslationsIndex(czech_translations)
+# file with ids generated in previous runs
+issued_ids = 'data/issued_ids.tsv'
+# seed for generating new ids, None for random ids
+id_seed = None
+# registry of used ids, generated ids never repeat the ones from czech_translations file
+id_registry = IdRegistry(issued_ids, seed=id_seed, known_ids=translations_index.identifiers)
 # initial table 
 IN = 'Bibliografie_prekladu.csv'
 # final file
 OUT = 'data/marc_it.mrc'
 
-df = pd.read_csv(IN, encoding='utf_8')
-
 # table with authority codes
 finalauthority_path = 'data/finalauthority_simple.csv'
-finalauthority = pd.read_csv(finalauthority_path,  index_col=0)
-finalauthority.index= finalauthority['nkc_id']
+finalauthority = AuthorityResolver(finalauthority_path)
+
+# number of rows converted together by one worker process
+CHUNK_SIZE = 500
+# records converted in previous runs, used in incremental mode
+RECORD_CACHE = 'data/marc_it_cache.sqlite'
+# rows with errors found by validation, with the list of their problems
+QUARANTINE = 'data/marc_it_quarantine.csv'
+
+def record_id(number):
+    """Creates id of the record used in fields 001 and 994 from its number in the table"""
+    number = str(number)
+    return 'it22' + "".join(['0' for a in range(6-len(number))]) + number
+
+
+class RecordIndex:
+    """Index of the table built in one pass before the records are created.
+    Maps record number to the row and collective work's record number to the numbers of its parts.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        # record number: position of the row in the table
+        self.positions = {}
+        # record number of the collective work: record numbers of its parts
+        self.children = {}
+        for position, row in enumerate(rows):
+            # first row with the number is used
+            if not row.number in self.positions:
+                self.positions[row.number] = position
+            if not isnull(row.part_of):
+                self.children.setdefault(row.part_of, []).append(row.number)
+
+    def row(self, number):
+        """Returns row of the record with the given number"""
+        return self.rows[self.positions[number]]
+
+    def parts(self, number):
+        """Returns record numbers of all parts of the collective work"""
+        return self.children.get(number, [])
 
-# list of italian articles for field 245 
-italian_articles =  ['il', 'lo', 'la', 'gli', 'le', 'i', 'un', 'una', 'uno', 'dei', 'degli', 'delle']
 
 def delete_whitespaces(string):
     """Method for deleting unnecessary spaces and new lines in strings"""   
-    while string[0] == '\n' or string[0] == ' ':  
-        string = string[1:]
-    while string[-1] == '\n' or string[-1] == ' ': 
-        string = string[0:-1]
-    return string    
+    return string.strip(' \n')
 
 
 def add_008(row, record):
@@ -69,25 +96,13 @@ def add_008(row, record):
     date_record_creation = str(datetime.today().strftime('%y%m%d'))
     letter = 's'
 
-    if pd.isnull(row['Rok']):
+    if isnull(row.year):
         publication_date = '--------'
     else:
-        publication_date = str(int(row['Rok']))+ '----' 
-
-    if pd.isnull(row['Město vydání, země vydání, nakladatel']):
-        publication_country = 'xx-'
+        publication_date = str(int(row.year))+ '----' 
 
-    else:
-        publication = row['Město vydání, země vydání, nakladatel'] 
-        start = publication.find('(')+1
-        end = publication.find(')') 
-        country = publication[start:end]
-        if country == 'Itálie':
-            publication_country = 'it-'
-        elif country == 'Česká republika':
-            publication_country = 'xr-'    
-        else:
-            publication_country = 'xx-'
+    # country code parsed from column 'Město vydání, země vydání, nakladatel'
+    publication_country = row.country_code
 
     material_specific =  '-----------------'
     language = 'ita'
@@ -96,59 +111,43 @@ def add_008(row, record):
     data = date_record_creation + letter + publication_date +  publication_country + material_specific + language + modified + cataloging_source
     record.add_ordered_field(Field(tag='008', indicators = [' ', ' '], data = data))
 
-def generate_id(code):
-    """Generates 11 positional id for field 595. 
-    In case there is no authority code, id is random.
-    Otherwise generates id from the authority code.""" 
-    ID_LENGTH = 11
-    if code is None:
-        rand_number = str(random.randint(00000000000,99999999999))
-        # in case random number has less than 11 positions, add zeros at the beginning
-        if len(rand_number) < ID_LENGTH:
-            for i in range(ID_LENGTH-len(rand_number)):
-                rand_number = "0" + rand_number
-        return "ubc"+rand_number
-    rand_number = str(random.randint(1000,9999))
-    ret = "ubc"+code[0:4]+str(code[-2:])+rand_number
-    # in case generated id already exists, create a new one
-    while ret in identifiers:
-        rand_number = str(random.randint(1000,9999))
-        ret = "ubc"+code[0:4]+str(code[-2:])+rand_number
-    return ret  
-
-def add_595(record, row, author, code):
+def generate_id(code, key=None):
+    """Generates id for field 595 from the authority code.
+    The same key gets the same id, also in later runs, without key the id is always new.""" 
+    def candidate(rand):
+        return "ubc"+code[0:4]+str(code[-2:])+str(rand.randint(1000,9999))
+    # in case generated id already exists, registry creates a new one
+    return id_registry.reserve(candidate, key)
+
+def add_595(record, row, author_row):
     """Adds data to field 595. 
     Consists of author's name in subfield 'a', birth (and death) year in subfield 'd'
-    author's code in subfield '7', original title of the work in subfield 't' and generated id in subfield 't'""" 
-    original_work_title = delete_whitespaces(str(row['Původní název']))                                                                         
-    if author is not None:
-        if not code is None:
-            if code in finalauthority.index:
-                    date = str(finalauthority.loc[code]['cz_dates' ]) 
-            else:
-                date = None        
-        else:
-            date = None            
-            id = generate_id(code)
-        if not author.lower() in dict_author_work.keys():
-            if ("originál neznámý" in original_work_title.lower())  or ("originál neexistuje" in original_work_title.lower()):
+    author's code in subfield '7', original title of the work in subfield 't' and generated id in subfield 't'
+    Author is taken from author_row (the collective work for parts without their own author).""" 
+    original_work_title = str(row.original_title)
+    author = author_row.author
+    code = author_row.author_code
+    date = author_row.author_dates
+    if not isnull(author):
+        # exact, normalized or fuzzy match of the work in the Czech translations file
+        id = translations_index.match(author, original_work_title)
+        if id is None:
+            # without the authority code the id isn't used in the record
+            if ("originál neznámý" in original_work_title.lower())  or ("originál neexistuje" in original_work_title.lower()) or isnull(code):
                 id = None  
             else:
-                id = generate_id(code)          
-        else:
-            dict_works = dict_author_work[author.lower()]
-            if original_work_title.lower() in dict_works.keys():
-                id = dict_works[original_work_title.lower()]
-            else:
-                if ("originál neznámý" in original_work_title.lower())  or ("originál neexistuje" in original_work_title.lower()):
-                    id = None  
+                # works without the original title can't be told apart, every one gets the id of its record
+                if isnull(row.original_title):
+                    key = make_key(code, '#' + str(row.number))
                 else:
-                    id = generate_id(code) 
+                    # same normalization as the index, titles differing in case, diacritics or punctuation get one id
+                    key = make_key(code, normalize_key(original_work_title))
+                id = generate_id(code, key)
            
-        if code is None:
+        if isnull(code):
             record.add_ordered_field(Field(tag='595', indicators = ['1', '2'], subfields = ['a', author ]))
         else: 
-            if date is None: 
+            if isnull(date): 
                 if id is None:
                     record.add_ordered_field(Field(tag='595', indicators = ['1', '2'], subfields = ['a', author,
                                                                             '7', str(code) ])) 
@@ -168,183 +167,107 @@ def add_595(record, row, author, code):
                                                                             '7', str(code),
                                                                             't', original_work_title ,
                                                                             '1', id ]))  
-    if not(pd.isnull(row['Údaje o zprostředkovacím díle'])):
+    if not(isnull(row.intermediary_work)):
         record.add_ordered_field(Field(tag='595', indicators = [' ', ' '], subfields = ['i',  "Zdroj překladu:",
-                                                                                        't', delete_whitespaces(row['Údaje o zprostředkovacím díle']) ]))
+                                                                                        't', row.intermediary_work ]))
              
 def add_773(record, row):   
     """Adds data to field 773. Only for magazines.
     Consists of jurnal issue data. 
     In subfield 't' magazine's title, in subfield 'g' additional magazine data, in subfield '9' year of publication
     """ 
-    data = row['Údaje o časopiseckém vydání']
+    data = row.magazine_issue
     comma = data.find(',') 
     if not comma == -1:
         magazine = data[:comma]
         rest = delete_whitespaces(data[comma+1:])
-        year = str(int(row['Rok']))
+        year = str(int(row.year))
         record.add_ordered_field(Field(tag='773', indicators = ['0', ' '], subfields = ['t', magazine, 
                                                                             'g', rest,
                                                                             '9', year ]))
                                                                     
 
-def add_author_code(data, record):
+def add_author_code(row, record):
     """Adds authors name and code into field 100.
-    Also returns author's name and code as a tuple.
+    Name and code are split in column 'Autor/ka + kód autority' during normalization,
+    dates are looked up from the authority code before the records are created.
     """ 
-    if not(pd.isnull(data)):
-        start = data.find('(')
-        end = data.find(')') 
-        if start == -1:
-            record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', delete_whitespaces(data), 
-                                                                                '4', 'aut']))
-            return (data, None)
-        # matches everything before '(' character 
-        author = delete_whitespaces(re.search('.*(?=\s+\()', data).group(0))
-        code = delete_whitespaces(data[start+1: end])
-        if code in finalauthority.index:
-                date = str(finalauthority.loc[code]['cz_dates' ]) 
-                record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', author,
-                                                                                'd', date,
-                                                                                '7', code, 
-                                                                                '4', 'aut']))    
-        else:
-                date = None  
-                record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', author,
-                                                                                '7', code, 
-                                                                                '4', 'aut']))
-        return (author, code)
+    author = row.author
+    code = row.author_code
+    if isnull(author):
+        return
+    if isnull(code):
+        record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', author, 
+                                                                            '4', 'aut']))
+    elif not isnull(row.author_dates):
+            record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', author,
+                                                                            'd', row.author_dates,
+                                                                            '7', code, 
+                                                                            '4', 'aut']))    
     else:
-        return (None, None)
+            record.add_ordered_field(Field(tag='100', indicators=['1',' '], subfields=['a', author,
+                                                                            '7', code, 
+                                                                            '4', 'aut']))
 
 def get_title_subtitle(data):
     """Splits work's title into title and subtitle.
     Returns as tuple.
     """
     data = delete_whitespaces(data)
-    split = data.find(':')
-    if split == -1:
-        return (data, '' )
-    else:
-        title = data[:split]
-        subtitle = data[split+1:]
-        title = delete_whitespaces(title)
-        subtitle = delete_whitespaces(subtitle)         
-        return(title, subtitle)   
+    (title, colon, subtitle) = data.partition(':')
+    return (delete_whitespaces(title), delete_whitespaces(subtitle))
 
 def add_264(row, record):
     """Adds data to subfield 264. 
     Consists of city of publication, coutry of publications and the publisher
+    In case there are more publishers (divided by §), multiplies field 264.
     """
-    if pd.isnull(row['Město vydání, země vydání, nakladatel']):
+    if isnull(row.publication):
         return record    
-    city_country_publisher = delete_whitespaces(row['Město vydání, země vydání, nakladatel'])
-    while True:
-                                # Matches everything before ( 
-        city_unknown = re.search('.*(?=\s+\()', city_country_publisher).group(0)
-        # if string contains ? -> city is unknown
-        if  '?' in city_unknown:
-            city = "[s. l.]"
-        else:  
-            # matches first words in string   
-            city =  delete_whitespaces(re.search('^[\w\s]+', city_country_publisher).group(0))
-        if '§' in city_country_publisher:
-            # finds position of character §
-            start = city_country_publisher.find('§') 
-            # finds the character ":" a matches everything behind it 
-            publisher = re.search('(?<=\:\s).+', delete_whitespaces(city_country_publisher[:start])).group(0)
-            year = row['Rok'] 
-            record.add_ordered_field(Field(tag = '264', indicators = [' ', '1'], subfields = ['a', city + ':', 
+    year = str(int(row.year))
+    cities = row.cities
+    publishers = row.publishers
+    for city, publisher in zip(cities[:-1], publishers[:-1]):
+        record.add_ordered_field(Field(tag = '264', indicators = [' ', '1'], subfields = ['a', city + ':', 
                                                                             'b', publisher, 
-                                                                            'c', str(int(year))]))
-            city_country_publisher = city_country_publisher[start + 1: ]
-           
-        else:
-            break    
-    # finds the character ":" a matches everything behind it     
-    publisher = delete_whitespaces(re.search('(?<=\:\s).+', city_country_publisher).group(0))
-    year = row['Rok']
-    record.add_ordered_field(Field(tag = '264', indicators = [' ', '1'], subfields = ['a', city + ':', 
-                                                                            'b', publisher + ',',
-                                                                            'c', str(int(year)) ]))  
+                                                                            'c', year]))
+    record.add_ordered_field(Field(tag = '264', indicators = [' ', '1'], subfields = ['a', cities[-1] + ':', 
+                                                                            'b', publishers[-1] + ',',
+                                                                            'c', year ]))  
      
 
 def add_translator(translators, record):
     """Adds translators to field 700.
     In case there are more than 1 translator, multiplies field 700.
     """
-    # iterates through all iteraters devided by character §
-    while '§' in translators:
-            start = translators.find('§') 
-            t = delete_whitespaces(translators[:start ])
-            record.add_ordered_field(Field(tag='700', indicators=['1',' '], subfields=['a', t,
-                                                                                        '4', 'trl'])) 
-            translators = translators[start+1:]
-    t = delete_whitespaces(translators)        
-    record.add_ordered_field(Field(tag='700', indicators=['1',' '], subfields=['a', t,
+    for t in translators:
+        record.add_ordered_field(Field(tag='700', indicators=['1',' '], subfields=['a', t,
                                                                                         '4', 'trl']))
-def c_245(row, liability,author, translators):
+def c_245(liability, author, translators):
     """Method for creating string used in field 245 subfield c.
     String structure: [Author's name] [Author's name] ; traduzione di [translator's name] [translator's surname] ; liability informations 
+    Author and translators are already in format 'Name Surname'.
     """
     c = ""
-    print("c 245 author: " + author)
-    if not pd.isnull(author): 
-        # finds the character "," a matches everything ahead it 
-        surname = delete_whitespaces(re.search('.*(?=,)', author ).group(0)) 
-        # finds the character "," a matches everything behind it
-        name = delete_whitespaces(re.search('(?<=\,\s).+', author).group(0))
-        c += name + ' ' + surname + ' '
-    if not(pd.isnull(translators)):  
-        c += '; traduzione di '
-        while True:
-                # there are more than 1 translator
-                if '§' in translators:
-                    # finds character §
-                    start = translators.find('§') 
-                    # finds the character "," a matches everything ahead it 
-                    surname = delete_whitespaces(re.search('.*(?=,)', translators[:start] ).group(0)) 
-                    # finds the character "," a matches everything behind it 
-                    name = delete_whitespaces(re.search('(?<=\,\s).+', translators[:start]).group(0)) 
-                    c += name + ' ' +  surname + ', '
-                    translators = translators[start + 1: ]
-                else:
-                    break 
-        # finds the character "," a matches everything ahead it 
-        surname = delete_whitespaces(re.search('.*(?=,)', translators ).group(0)) 
-        # finds the character "," a matches everything behind it 
-        name = delete_whitespaces(re.search('(?<=\,\s).+', translators).group(0))
-        c += name + ' ' +  surname 
-    if not pd.isnull(liability):
-        c += ' ; ' + delete_whitespaces(str(liability))   
+    if not isnull(author): 
+        c += author + ' '
+    if not(isnull(translators)):  
+        c += '; traduzione di ' + translators
+    if not isnull(liability):
+        c += ' ; ' + str(liability)
     return c    
 
-def add_245(row, liability, title, subtitle, author, translators,  record):
+def add_245(liability, title, subtitle, author, translators,  record):
     """Adds data to subfield 245. 
     Finds if work's title starts with an article -> writes how many positions the article takes
     """
-    # matches first word in string
-    first_word = re.search('^([\w]+)', title)
-    if not first_word is None: 
-        # matches first word in string
-        first_word = re.search('^([\w]+)', title).group(0)
-        if first_word.lower() in italian_articles:
-            skip = str(len(first_word) + 1)
-        else:
-            skip = str(0)    
-    else:
-        skip = str(0)
-    if title[0:2].lower() == "l'":
-            skip = str(2)
-    if title[0:2].lower() == "un'":
-            skip = str(3) 
-    c = c_245(row, liability, author, translators)  
-    title = delete_whitespaces(title)      
+    # article at the beginning of the title, memoized for the repeated titles
+    skip = nonfiling_characters(title)
+    c = c_245(liability, author, translators)  
     if subtitle == '' and c == '':                                                                          
         record.add_ordered_field(Field(tag = '245', indicators = ['0', skip], subfields = ['a', title + " ."]))                                                                          
     else:
         if c == '':
-            subtitle = delete_whitespaces(subtitle)
             record.add_ordered_field(Field(tag = '245', indicators = ['0', skip], subfields = ['a', title + " :", 
                                                                                     'b', subtitle + " ."]))
         elif subtitle == '':  
@@ -352,150 +275,362 @@ def add_245(row, liability, title, subtitle, author, translators,  record):
             record.add_ordered_field(Field(tag = '245', indicators = ['1', skip], subfields = ['a', title + " /", 
                                                                                     'c', c]))
         else:
-            subtitle = delete_whitespaces(subtitle)
             c = delete_whitespaces(c) 
             record.add_ordered_field(Field(tag = '245', indicators = ['1', skip], subfields = ['a', title + " :",
                                                                                     'b', subtitle + " /", 
                                                                                     'c', c]))
 
 
-def add_commmon(row, record, author, code, translators):
+def add_commmon(row, record, author_row, translators_row):
     """Adds data to fields that are common for all work types 
+    Author and translators are taken from author_row and translators_row (the collective work for its parts).
     """
-    record.add_ordered_field(Field(tag='001', indicators = [' ', ' '], data=str('it22'+ "".join(['0' for a in range(6-len(str(row['Číslo záznamu'])))]) + str(row['Číslo záznamu'])))) 
+    record.add_ordered_field(Field(tag='001', indicators = [' ', ' '], data=record_id(row.number))) 
     record.add_ordered_field(Field(tag='003', indicators = [' ', ' '], data='CZ PrUCL')) 
     
-    if not(pd.isnull(row['ISBN'])):
-        record.add_ordered_field(Field(tag='020', indicators=[' ',' '], subfields=['a', delete_whitespaces(str(row['ISBN']))] )) 
+    if not(isnull(row.isbn)):
+        record.add_ordered_field(Field(tag='020', indicators=[' ',' '], subfields=['a', str(row.isbn)] )) 
 
     record.add_ordered_field(Field(tag='040', indicators=[' ',' '], subfields=['a', 'ABB060',
                                                                                'b', 'cze',
                                                                                'e', 'rda']))
     
-    if  pd.isnull(row['Zprostředkovací jazyk']):                                                                          
-        record.add_ordered_field(Field(tag='041', indicators=['1',' '],subfields=['a', re.search('[^\s]+', str(row['Jazyk díla'])).group(0),
-                                                                             'h', re.search('[^\s]+', str(row['Výchozí jazyk '])).group(0)])) 
+    if  isnull(row.intermediary_language):                                                                          
+        record.add_ordered_field(Field(tag='041', indicators=['1',' '],subfields=['a', first_token(str(row.language)),
+                                                                             'h', first_token(str(row.source_language))])) 
     else:
-        record.add_ordered_field(Field(tag='041', indicators=['1',' '],subfields=['a', re.search('[^\s]+', str(row['Jazyk díla'])).group(0),
-                                                                             'h', re.search('[^\s]+', str(row['Výchozí jazyk '])).group(0),
-                                                                             'k', re.search('[^\s]+', str(row['Zprostředkovací jazyk'])).group(0)]) )
+        record.add_ordered_field(Field(tag='041', indicators=['1',' '],subfields=['a', first_token(str(row.language)),
+                                                                             'h', first_token(str(row.source_language)),
+                                                                             'k', first_token(str(row.intermediary_language))]) )
     
                                                 # "originál neznámý" or "originál neexistuje" is not used in the column 'Původní název'
-    if not(pd.isnull(row['Původní název'])) and not (("originál neznámý" in str(row['Původní název']).lower())  or ("originál neexistuje" in str(row['Původní název']).lower())):
-        original_title = delete_whitespaces(row['Původní název'])                                                                        
+    if not(isnull(row.original_title)) and not (("originál neznámý" in str(row.original_title).lower())  or ("originál neexistuje" in str(row.original_title).lower())):
+        original_title = row.original_title                                                                        
         record.add_ordered_field(Field(tag='240', indicators = ['1', '0'], subfields = ['a', original_title , 
                                                                               'l', 'italsky' ]))
         
-    if not(pd.isnull(row['Počet stran'])) and row['Počet stran'].isnumeric():
-        record.add_ordered_field(Field(tag = '300', indicators=[' ', ' '], subfields=['a', str(int(row['Počet stran'])) + ' p.']))
+    if not(isnull(row.pages)) and row.pages.isnumeric():
+        record.add_ordered_field(Field(tag = '300', indicators=[' ', ' '], subfields=['a', str(int(row.pages)) + ' p.']))
     
-    if not(pd.isnull(row['Zdroj či odkaz'])) and not (row['Zdroj či odkaz'] == ' '):
-          record.add_ordered_field(Field(tag = '998', indicators=[' ', ' '], subfields=['a', delete_whitespaces(row['Zdroj či odkaz']) ] ) )
+    if not(isnull(row.source)):
+          record.add_ordered_field(Field(tag = '998', indicators=[' ', ' '], subfields=['a', row.source ] ) )
 
-    add_595(record, row, author, code)  
+    add_595(record, row, author_row)  
     record.add_ordered_field(Field(tag = '500', indicators=[' ', ' '], subfields=['a', "Záznam zpracován bez výtisku v ruce"]))
 
-    if not(pd.isnull(translators)):
-        add_translator(translators, record ) 
+    if not(translators_row.translators is None):
+        add_translator(translators_row.translators, record ) 
 
-    (title, subtitle) = get_title_subtitle(str(row['Název díla dle titulu (v příslušném písmu)']))
-    liabiliy = row['Údaje o odpovědnosti a další informace']
-    add_245(row, liabiliy, title, subtitle, author, translators,record)    
+    liabiliy = row.liability
+    add_245(liabiliy, row.title, row.subtitle, author_row.author_natural, translators_row.translators_natural, record)    
     record.add_ordered_field(Field(tag = '910', indicators=[' ', ' '], subfields=['a', 'ABB060' ] ) )
     record.add_ordered_field(Field(tag = '964', indicators=[' ', ' '], subfields=['a', 'TRL' ] ) )
     record.add_ordered_field(Field(tag = 'OWN', indicators = [' ', ' '], subfields = ['a', 'UCLA']))
 
-def add_994_book(row, df, record):
+def add_994_book(row, record_index, record):
     """Adds id's of all parts of the collective work to field 994."""
-    cislo_zaznamu = row['Číslo záznamu']
-    is_part_of = df['Je součást čeho (číslo záznamu)']==cislo_zaznamu
-    if any(is_part_of):
-        book_rows = [i for i, val in enumerate(is_part_of) if val]
-        sf = ['a', 'DN', 'b']
-        for i in book_rows:
-            r = df.iloc[i]
-            sf.append("it22"+"".join(['0' for a in range(6-len(str(row['Číslo záznamu'])))]) + str(r['Číslo záznamu']))
-            record.add_ordered_field(Field(tag = '994', indicators = [' ', ' '], subfields = sf))
-            sf = ['a', 'DN', 'b']
+    for part in record_index.parts(row.number):
+        record.add_ordered_field(Field(tag = '994', indicators = [' ', ' '], subfields = ['a', 'DN', 'b', record_id(part)]))
 
 def add_994_part_of_book(row, record):
     """Adds id of the collective work to field 994."""
     sf = ['a', 'UP', 'b']   
-    is_part_of = str(int(row['Je součást čeho (číslo záznamu)']))
-    sf.append("it22"+"".join(['0' for a in range(6-len(is_part_of))]) + is_part_of)
+    is_part_of = str(int(row.part_of))
+    sf.append(record_id(is_part_of))
     record.add_ordered_field(Field(tag = '994', indicators = [' ', ' '], subfields = sf))
 
-def create_record_part_of_book(row, df):
+def create_record_part_of_book(row, record_index):
     """Creates record for part of the book.
     Adds all fields that are specific to parts of book"""
-    record = Record(to_unicode=True,
-        force_utf8=True)
+    record = Record()
     record.leader = '-----naa---------4i-4500'  
-    ind = int(row['Je součást čeho (číslo záznamu)'])
-    book_row = df.loc[df['Číslo záznamu'] == ind]
+    ind = int(row.part_of)
+    book_row = record_index.row(ind)
     # is the author same as in the collective work, or does the book has it's own author 
-    if pd.isnull(row['Autor/ka + kód autority']):
-        tup = add_author_code(book_row['Autor/ka + kód autority'].values[0], record)
-        author = tup[0] 
-        code = tup[1]
+    if isnull(row.author):
+        author_row = book_row
     else:
-        tup = add_author_code(row['Autor/ka + kód autority'], record)
-        author = tup[0] 
-        code = tup[1]    
-    translators = book_row['Překladatel/ka'].values[0]
-    # from Dataframe to Pandas Series
-    book_row = book_row.squeeze()
+        author_row = row
+    add_author_code(author_row, record)
     add_008(book_row, record)
     add_264(book_row, record)
-    add_commmon(row, record, author, code, translators)  
+    add_commmon(row, record, author_row, book_row)  
     add_994_part_of_book(row, record)
     return record
 
 
-def create_record_book(row, df):
+def create_record_book(row, record_index):
     """Creates record for book.
     Adds all fields that are specific to books"""
-    record = Record(to_unicode=True,
-        force_utf8=True)
+    record = Record()
     record.leader = '-----nam---------4i-4500'
-    tup = add_author_code(row['Autor/ka + kód autority'], record)
-    author = tup[0]
-    code = tup[1]
-    translators = row['Překladatel/ka']
+    add_author_code(row, record)
     add_008(row, record)
-    add_commmon(row, record, author, code, translators)      
+    add_commmon(row, record, row, row)      
     add_264(row, record)
-    if row['typ díla (celé dílo, úryvek, antologie, souborné dílo)'] == 'souborné dílo':
-        add_994_book(row, df, record)     
+    if row.work_type == 'souborné dílo':
+        add_994_book(row, record_index, record)     
     return record
 
 def create_article(row):
     """Creates record for the article.
     Adds all fields that are specific to articles."""
-    record = Record(to_unicode=True,
-        force_utf8=True)
+    record = Record()
     record.leader = '-----nab---------4i-4500' 
-    tup = add_author_code(row['Autor/ka + kód autority'], record)
-    author = tup[0]
-    code = tup[1]
-    translators = row['Překladatel/ka']
+    add_author_code(row, record)
     add_008(row, record) 
-    add_commmon(row, record, author, code, translators)
+    add_commmon(row, record, row, row)
     add_773(record, row)
     return record 
 
-# writes data to file in variable OUT
-with open(OUT , 'wb') as writer:
-    #iterates all rows in the table
-    for index, row in df.iterrows():
-        print(row['Číslo záznamu'])
-        if 'kniha' in row['Typ záznamu']: 
-            record = create_record_book(row, df)
-        if 'část knihy' in row['Typ záznamu']: 
-            record = create_record_part_of_book(row, df)
-        if 'článek v časopise' in row['Typ záznamu']:
-            record = create_article(row)
-        print(record)    
-        writer.write(record.as_marc())
-writer.close()
+def create_record(row, record_index):
+    """Creates record according to the type of the record in column 'Typ záznamu'.
+    Returns None for unknown types."""
+    record = None
+    if 'kniha' in row.record_type: 
+        record = create_record_book(row, record_index)
+    if 'část knihy' in row.record_type: 
+        record = create_record_part_of_book(row, record_index)
+    if 'článek v časopise' in row.record_type:
+        record = create_article(row)
+    return record
+
+# tables read in the background by prefetch(), path: future of the DataFrame
+prefetched_tables = {}
+
+def read_csv(path):
+    import pandas as pd
+    return pd.read_csv(path, encoding='utf_8')
+
+def read_table(path):
+    """Returns the table read from the CSV file, waits for it if it is read by prefetch()"""
+    if path in prefetched_tables:
+        return prefetched_tables.pop(path).result()
+    return read_csv(path)
+
+def prefetch(path=None):
+    """Starts loading of all inputs at once, before the records are created.
+    The Czech translations index is checked (and rebuilt) in another process, the authority table
+    and the table in path are read in threads. Table and authority table are needed to normalize the table,
+    the index is waited for only at the first lookup of field 595."""
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    # process is started before the threads, forking a process with running threads isn't safe
+    processes = ProcessPoolExecutor(1)
+    translations_index.prefetch(processes)
+    threads = ThreadPoolExecutor(2)
+    finalauthority.prefetch(threads)
+    if not path is None:
+        prefetched_tables[path] = threads.submit(read_csv, path)
+    # already submitted loading continues, executors are closed when it is finished
+    processes.shutdown(wait=False)
+    threads.shutdown(wait=False)
+
+def load_frame(path):
+    """Reads the table and prepares it for creating records.
+    Returns tuple (normalized DataFrame, columns of the table)."""
+    from normalization import normalize_table
+    table = read_table(path)
+    # all columns are trimmed and split before the records are created
+    df = normalize_table(table)
+    # author's dates are looked up once for every authority code
+    df['author_dates'] = finalauthority.resolve(df['author_code'])
+    return (df, list(table.columns))
+
+def load_table(path):
+    """Reads the table and prepares it for creating records.
+    Returns list of rows of the table."""
+    from normalization import table_rows
+    (df, columns) = load_frame(path)
+    return table_rows(df)
+
+def load_valid_rows(path, on_error, quarantine=QUARANTINE):
+    """Reads the table, reports all its problems and returns list of rows without errors.
+    on_error is 'skip' (rows with errors are left out), 'quarantine' (they are also written to quarantine file)
+    or 'fail' (returns None if any row has errors)."""
+    from normalization import table_rows
+    import validation
+    (df, columns) = load_frame(path)
+    problems = validation.validate(df)
+    validation.report(problems)
+    invalid = validation.invalid_rows(problems)
+    if len(invalid) > 0:
+        if on_error == 'fail':
+            return None
+        if on_error == 'quarantine':
+            validation.write_quarantine(df, problems, columns, quarantine)
+            log.info('%d rows with errors written to %s', len(invalid), quarantine)
+    elif on_error == 'quarantine' and os.path.exists(quarantine):
+        # quarantine of an earlier run is out of date
+        os.remove(quarantine)
+    return table_rows(df.drop(invalid))
+
+# rows of the table and their links used by convert_rows, set in main() or in init_worker() in worker processes
+record_index = None
+# profiler of the record builders, None if profiling is off (functions are not wrapped then)
+profiler = None
+
+def enable_profiling():
+    """Wraps the add_* and create_* functions of this module with the profiler"""
+    global profiler
+    profiler = Profiler()
+    profiler.instrument(sys.modules[__name__])
+    profiler.count_patterns(parsing)
+
+def init_worker(index, level, profile=False, threshold=MATCH_THRESHOLD):
+    """Sets the rows of the table, logging, profiling and matching of works in the worker process"""
+    global record_index
+    record_index = index
+    setup_logging(level)
+    translations_index.threshold = threshold
+    # forked workers already have the wrapped functions of the main process
+    if profile and profiler is None:
+        enable_profiling()
+    elif not profiler is None:
+        # statistics collected by the main process before the fork are counted there
+        profiler.reset()
+
+def convert_rows(positions):
+    """Creates records for the rows on the positions in the table.
+    Returns the records serialized to marc, in the order of the rows (None for rows of unknown type)."""
+    records = []
+    for position in positions:
+        row = record_index.rows[position]
+        record = create_record(row, record_index)
+        if record is None:
+            log.warning('Record %s has unknown type %r, skipped', row.number, row.record_type)
+            records.append(None)
+            continue
+        # record is formatted only in verbose mode
+        log.debug('Record %s:\n%s', row.number, record)
+        records.append(record.as_marc())
+    return records
+
+def convert_chunk(positions):
+    """Same as convert_rows, also returns statistics collected in the worker process for the rows:
+    numbers of matched works and statistics of the profiler (None if profiling is off)"""
+    records = convert_rows(positions)
+    return (records, translations_index.pop_stats(), None if profiler is None else profiler.pop())
+
+def convert(positions, workers, chunk_size):
+    """Yields tuples (position, record serialized to marc) for all positions, in their order.
+    With more than one worker, chunks of rows are converted in worker processes."""
+    positions = list(positions)
+    chunks = [positions[start:start + chunk_size] for start in range(0, len(positions), chunk_size)]
+    if workers > 1:
+        import multiprocessing
+        initargs = (record_index, log.getEffectiveLevel(), not profiler is None, translations_index.threshold)
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+            # imap returns the chunks in the original order
+            for chunk, (records, match_stats, profile) in zip(chunks, pool.imap(convert_chunk, chunks)):
+                # statistics of the workers are added to the ones of the main process
+                translations_index.match_stats.update(match_stats)
+                if not profile is None:
+                    profiler.merge(profile)
+                yield from zip(chunk, records)
+    else:
+        for chunk in chunks:
+            yield from zip(chunk, convert_rows(chunk))
+
+def convert_incremental(rows, sinks, workers, chunk_size):
+    """Converts only new and changed rows, records of other rows are copied from the cache"""
+    from record_cache import RecordCache, record_hashes
+    # cached records are valid only with the same lookup files and matching of works
+    cache = RecordCache(RECORD_CACHE, dependencies=[file_signature(czech_translations),
+                                                    file_signature(finalauthority_path),
+                                                    translations_index.threshold])
+    cached = cache.load()
+    hashes = record_hashes(record_index)
+    changed = [position for position, row in enumerate(rows)
+               if cached.get(str(row.number), (None, None))[0] != hashes[position]]
+    log.info('%d of %d records converted again', len(changed), len(rows))
+    progress = Progress(len(changed), log)
+    converted = {}
+    for position, marc in convert(changed, workers, chunk_size):
+        converted[position] = marc
+        progress.update()
+    progress.finish()
+    for position, row in enumerate(rows):
+        if position in converted:
+            marc = converted[position]
+        else:
+            marc = cached[str(row.number)][1]
+        if not marc is None:
+            sinks.write(marc)
+    cache.update([(str(rows[position].number), hashes[position], marc) for position, marc in converted.items()])
+    cache.prune(str(row.number) for row in rows)
+    cache.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Transforms the table of Italian translations to a marc file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes creating the records (default: 1, no worker processes)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='number of rows converted together by one worker (default: %(default)s)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='convert only rows changed since the last incremental run, take other records from ' + RECORD_CACHE)
+    parser.add_argument('--output', default=OUT, help='marc file, other formats are written next to it (default: %(default)s)')
+    parser.add_argument('--format', nargs='+', choices=list(SINKS), default=['marc'], dest='formats',
+                        help='output formats written in one pass (default: marc)')
+    parser.add_argument('--gzip', action='store_true', help='compress all outputs with gzip')
+    add_sharding_arguments(parser)
+    parser.add_argument('--on-error', choices=['skip', 'quarantine', 'fail'], default='quarantine',
+                        help='rows with errors are skipped, also written to ' + QUARANTINE + ' (default), or nothing is written')
+    parser.add_argument('--validate-only', action='store_true',
+                        help='only report problems of the table, exit with status 1 if any row has errors')
+    parser.add_argument('--match-threshold', type=float, default=MATCH_THRESHOLD,
+                        help='minimal similarity of fuzzy matched authors and works in field 595, e.g. 0.9, fuzzy matches are logged for review (default: %(default)s, fuzzy matching off)')
+    parser.add_argument('--profile', metavar='JSON',
+                        help='measure time and calls of the add_* and create_* functions per tag and record type, write them to JSON')
+    parser.add_argument('--profile-folded', metavar='FILE',
+                        help='write the measured time as folded stacks for flame graphs (flamegraph.pl, speedscope)')
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(logging_level(args))
+    sharding = sharding_options(parser, args)
+    if args.profile or args.profile_folded:
+        enable_profiling()
+    translations_index.threshold = args.match_threshold
+
+    global record_index
+    # lookup tables and the table are loaded concurrently
+    prefetch(IN)
+    if args.validate_only:
+        import validation
+        (df, columns) = load_frame(IN)
+        problems = validation.validate(df)
+        validation.report(problems)
+        parser.exit(1 if len(validation.invalid_rows(problems)) > 0 else 0)
+    rows = load_valid_rows(IN, args.on_error)
+    if rows is None:
+        parser.exit(1, 'Table has errors, nothing was written\n')
+    # links between collective works and their parts
+    record_index = RecordIndex(rows)
+    if args.workers > 1:
+        # lookup tables are opened before the workers start, so they are built only once,
+        # without workers the index is waited for at the first lookup
+        translations_index.connection
+        id_registry.load_known()
+
+    # writes data to file in variable OUT (or --output) and to the other chosen formats,
+    # files are replaced only when all records are written
+    with Sinks(args.output, args.formats, args.gzip, **sharding) as sinks:
+        if args.incremental:
+            convert_incremental(rows, sinks, args.workers, args.chunk_size)
+        else:
+            progress = Progress(len(rows), log)
+            for position, marc in convert(range(len(rows)), args.workers, args.chunk_size):
+                if not marc is None:
+                    sinks.write(marc)
+                progress.update()
+            progress.finish()
+    log.info(finalauthority.stats())
+    log.info(translations_index.stats())
+    if not profiler is None:
+        if args.profile:
+            profiler.dump_json(args.profile)
+        if args.profile_folded:
+            profiler.dump_folded(args.profile_folded)
+
+if __name__ == '__main__':
+    main()
 
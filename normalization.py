@@ -0,0 +1,136 @@
+# -----------------------------------------------------------
+# Normalization of the table before the records are created
+# Whole columns are trimmed with pandas string methods and parsed with the memoized
+# functions of module parsing, record builders then only read the pre-parsed values
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from collections import namedtuple
+from operator import itemgetter
+
+import pandas as pd
+
+from parsing import WHITESPACES, UNKNOWN_COUNTRY, parse_author, natural_name, parse_names, parse_publication
+
+# columns with numbers, all other columns are read as text
+NUMBER_COLUMNS = ['Číslo záznamu', 'Je součást čeho (číslo záznamu)', 'Rok']
+
+# column of the normalized table: field of TableRow
+ROW_FIELDS = {'Číslo záznamu': 'number',
+              'Typ záznamu': 'record_type',
+              'typ díla (celé dílo, úryvek, antologie, souborné dílo)': 'work_type',
+              'Je součást čeho (číslo záznamu)': 'part_of',
+              'Rok': 'year',
+              'Město vydání, země vydání, nakladatel': 'publication',
+              'Původní název': 'original_title',
+              'Údaje o zprostředkovacím díle': 'intermediary_work',
+              'Údaje o časopiseckém vydání': 'magazine_issue',
+              'Údaje o odpovědnosti a další informace': 'liability',
+              'ISBN': 'isbn',
+              'Jazyk díla': 'language',
+              'Výchozí jazyk ': 'source_language',
+              'Zprostředkovací jazyk': 'intermediary_language',
+              'Počet stran': 'pages',
+              'Zdroj či odkaz': 'source',
+              'author': 'author',
+              'author_code': 'author_code',
+              'author_natural': 'author_natural',
+              'author_dates': 'author_dates',
+              'title': 'title',
+              'subtitle': 'subtitle',
+              'country_code': 'country_code',
+              'cities': 'cities',
+              'publishers': 'publishers',
+              'translators': 'translators',
+              'translators_natural': 'translators_natural'}
+
+# one row of the normalized table with the values used by the record builders
+TableRow = namedtuple('TableRow', ROW_FIELDS.values())
+
+def text_value(value):
+    """Converts value of the cell to string, whole numbers are written without decimal zeros
+    (e.g. ISBN or number of pages that were read as numbers)"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def text_column(column):
+    """Converts all values of the column to strings, empty cells stay NaN"""
+    if pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty'):
+        return column.astype(object)
+    return column.map(text_value, na_action='ignore').astype(object)
+
+def strip_column(column):
+    """Deletes spaces and new lines at the beginning and the end of the strings in the column.
+    Strings left empty are replaced with NaN, other values are kept."""
+    stripped = column.str.strip(WHITESPACES)
+    column = stripped.where(stripped.notna(), column)
+    return column.mask(column == '')
+
+def number_column(column):
+    """Converts numbers written as text (e.g. '1968.0') to numbers.
+    Values that are not numbers are kept, so validation reports them."""
+    numbers = pd.to_numeric(column, errors='coerce')
+    if numbers.notna().sum() == column.notna().sum():
+        return numbers
+    return numbers.astype(object).where(numbers.notna(), column)
+
+def parsed_columns(column, parse, count):
+    """Parses every non-empty value of the column with the memoized function parse returning a tuple.
+    Returns list of 'count' columns, one for every item of the tuple, empty cells stay NaN."""
+    parsed = column.map(parse, na_action='ignore')
+    return [parsed.map(itemgetter(position), na_action='ignore') for position in range(count)]
+
+def normalize_author(df):
+    """Splits column with author and authority code 'Surname, Name (code)' to
+    columns 'author', 'author_code' and 'author_natural' ('Name Surname' used in field 245)."""
+    (df['author'], df['author_code']) = parsed_columns(df['Autor/ka + kód autority'], parse_author, 2)
+    df['author_natural'] = df['author'].map(natural_name, na_action='ignore')
+
+def normalize_title(df):
+    """Splits work's title to columns 'title' and 'subtitle'.
+    Missing title stays NaN (validation reports it)."""
+    split = df['Název díla dle titulu (v příslušném písmu)'].str.partition(':')
+    # frame of empty titles only (e.g. a small batch of the streamed table) is partitioned to one column
+    split = split.reindex(columns=[0, 1, 2]).astype(object)
+    df['title'] = split[0].str.strip(WHITESPACES)
+    df['subtitle'] = split[2].str.strip(WHITESPACES)
+
+def normalize_publication(df):
+    """Parses column 'City (Country): Publisher § City (Country): Publisher'.
+    Adds code of the country for field 008 to column 'country_code'
+    and tuples of cities and publishers for field 264 to columns 'cities' and 'publishers'."""
+    (country_code, cities, publishers) = parsed_columns(df['Město vydání, země vydání, nakladatel'], parse_publication, 3)
+    df['country_code'] = country_code.fillna(UNKNOWN_COUNTRY)
+    df['cities'] = cities.astype(object).where(cities.notna(), None)
+    df['publishers'] = publishers.astype(object).where(publishers.notna(), None)
+
+def normalize_translators(df):
+    """Splits translators divided by character § to tuple in column 'translators'
+    and joins their names in format 'Name Surname' to column 'translators_natural' (used in field 245)."""
+    (translators, natural) = parsed_columns(df['Překladatel/ka'], parse_names, 2)
+    df['translators'] = translators.astype(object).where(translators.notna(), None)
+    # translator without comma can't be written in natural order
+    df['translators_natural'] = natural.astype(object).where(natural.notna(), None)
+
+def normalize_table(df):
+    """Pre-processing stage run before the records are created.
+    Converts all columns except NUMBER_COLUMNS to text, trims them
+    and adds pre-parsed columns used by the record builders.
+    NUMBER_COLUMNS written as text are converted to numbers."""
+    df = df.copy()
+    for column in df.columns:
+        if column in NUMBER_COLUMNS:
+            df[column] = number_column(df[column])
+        else:
+            df[column] = strip_column(text_column(df[column]))
+    normalize_author(df)
+    normalize_title(df)
+    normalize_publication(df)
+    normalize_translators(df)
+    return df
+
+def table_rows(df):
+    """Returns list of TableRow for all rows of the normalized table.
+    Rows are created from tuples of column values, without a pandas Series for every row."""
+    return [TableRow._make(values) for values in df[list(ROW_FIELDS)].itertuples(index=False, name=None)]
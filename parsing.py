@@ -0,0 +1,116 @@
+# -----------------------------------------------------------
+# Parsing of the text values of the table
+# Patterns are compiled once and every value is parsed in one pass,
+# results are memoized, because the same authors, translators and publishers
+# appear in thousands of rows
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from functools import lru_cache
+import re
+
+# characters deleted at the beginning and the end of the strings
+WHITESPACES = ' \n'
+
+# country in the publication column: code used in field 008
+COUNTRY_CODES = {'Itálie': 'it-', 'Česká republika': 'xr-'}
+# country code used when the country is missing or unknown
+UNKNOWN_COUNTRY = 'xx-'
+# city used in field 264 when the city is unknown ('?')
+UNKNOWN_CITY = '[s. l.]'
+
+# list of italian articles for field 245
+ITALIAN_ARTICLES = {'il', 'lo', 'la', 'gli', 'le', 'i', 'un', 'una', 'uno', 'dei', 'degli', 'delle'}
+
+# matches everything before '(' character
+BEFORE_PARENTHESIS = re.compile(r'(.*)(?=\s+\()')
+# matches text in parentheses (authority code, country)
+IN_PARENTHESES = re.compile(r'\(([^)]*)\)')
+# matches everything ahead of the last comma
+SURNAME = re.compile(r'(.*)(?=,)')
+# matches everything behind the first comma
+NAME = re.compile(r'(?<=,\s)(.+)')
+# matches first words in string
+CITY = re.compile(r'^([\w\s]+)')
+# finds the character ":" a matches everything behind it
+PUBLISHER = re.compile(r'(?<=:\s)(.+)')
+# matches first word in string
+FIRST_WORD = re.compile(r'^([\w]+)')
+# matches first sequence of non-whitespace characters
+FIRST_TOKEN = re.compile(r'[^\s]+')
+
+def isnull(value):
+    """Checks whether the cell is empty (None or NaN), same as pandas.isnull for single values,
+    without importing pandas"""
+    # NaN is the only value not equal to itself
+    return value is None or value != value
+
+def group(pattern, string):
+    """Returns first group of the pattern's match trimmed of whitespaces, None if the pattern doesn't match"""
+    match = pattern.search(string)
+    if match is None:
+        return None
+    return match.group(1).strip(WHITESPACES)
+
+@lru_cache(maxsize=None)
+def parse_author(data):
+    """Splits 'Surname, Name (code)' to tuple (author, code).
+    Code is None if the value has no parentheses."""
+    if not '(' in data:
+        return (data, None)
+    return (group(BEFORE_PARENTHESIS, data), group(IN_PARENTHESES, data))
+
+@lru_cache(maxsize=None)
+def natural_name(name):
+    """Turns name in format 'Surname, Name' to 'Name Surname'.
+    None if the name doesn't contain comma."""
+    surname = group(SURNAME, name)
+    first_name = group(NAME, name)
+    if surname is None or first_name is None:
+        return None
+    return first_name + ' ' + surname
+
+@lru_cache(maxsize=None)
+def parse_names(data):
+    """Splits names divided by character § ('Surname, Name § Surname, Name').
+    Returns tuple (tuple of names, names in format 'Name Surname' joined by ', ').
+    Joined names are None if any of the names doesn't contain comma."""
+    names = tuple(name.strip(WHITESPACES) for name in data.split('§'))
+    natural = [natural_name(name) for name in names]
+    if None in natural:
+        return (names, None)
+    return (names, ', '.join(natural))
+
+@lru_cache(maxsize=None)
+def parse_publication(data):
+    """Parses 'City (Country): Publisher § City (Country): Publisher'.
+    Returns tuple (country code for field 008, tuple of cities, tuple of publishers).
+    Country is taken from the first parentheses, city is '[s. l.]' if it contains '?'."""
+    country = group(IN_PARENTHESES, data)
+    country_code = COUNTRY_CODES.get(country, UNKNOWN_COUNTRY)
+    cities = []
+    publishers = []
+    for segment in data.split('§'):
+        segment = segment.strip(WHITESPACES)
+        before = BEFORE_PARENTHESIS.search(segment)
+        if not before is None and '?' in before.group(1):
+            cities.append(UNKNOWN_CITY)
+        else:
+            cities.append(group(CITY, segment))
+        publishers.append(group(PUBLISHER, segment))
+    return (country_code, tuple(cities), tuple(publishers))
+
+@lru_cache(maxsize=None)
+def nonfiling_characters(title):
+    """Returns number of characters of the italian article at the beginning of the title (indicator 2 of field 245)"""
+    if title[0:2].lower() == "l'":
+        return '2'
+    first_word = FIRST_WORD.search(title)
+    if not first_word is None and first_word.group(0).lower() in ITALIAN_ARTICLES:
+        return str(len(first_word.group(0)) + 1)
+    return '0'
+
+@lru_cache(maxsize=None)
+def first_token(data):
+    """Returns first word of the value (e.g. language code from 'ita italsky')"""
+    return FIRST_TOKEN.search(data).group(0)
@@ -0,0 +1,176 @@
+# -----------------------------------------------------------
+# Opt-in profiling of the record builders
+# Wraps add_* and create_* functions of the converter, measures their time and calls
+# per MARC tag and per record type and counts matches of the parsing patterns
+# Without profiling the functions are not wrapped at all, so there is no overhead
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import functools
+import json
+import re
+import time
+
+# prefixes of the profiled functions
+PREFIXES = ('add_', 'create_', 'c_')
+# functions creating records: record type
+RECORD_TYPES = {'create_record_book': 'kniha',
+                'create_record_part_of_book': 'část knihy',
+                'create_article': 'článek v časopise'}
+# tags of the functions that don't have the tag in their name
+TAGS = {'add_author_code': '100',
+        'add_translator': '700',
+        'add_commmon': 'common',
+        # part of add_245, kept apart so time of 245 is not counted twice
+        'c_245': '245c'}
+
+def function_tag(name):
+    """Returns MARC tag filled by the function, or its name if there is no tag (e.g. create_record)"""
+    if name in TAGS:
+        return TAGS[name]
+    tag = re.search(r'\d{3}', name)
+    if tag is None:
+        return name
+    return tag.group(0)
+
+def add_stat(stats, key, seconds, calls=1):
+    stat = stats.setdefault(key, {'calls': 0, 'seconds': 0.0})
+    stat['calls'] += calls
+    stat['seconds'] += seconds
+
+
+class CountingPattern:
+    """Replaces a compiled pattern in the profiled module, counts its calls and matches"""
+
+    def __init__(self, profiler, pattern):
+        self._profiler = profiler
+        self._pattern = pattern
+
+    def __getattr__(self, name):
+        return getattr(self._pattern, name)
+
+    def _counted(self, name, *args, **kwargs):
+        result = getattr(self._pattern, name)(*args, **kwargs)
+        self._profiler.count_regex(self._pattern, result is not None)
+        return result
+
+    def search(self, *args, **kwargs):
+        return self._counted('search', *args, **kwargs)
+
+    def match(self, *args, **kwargs):
+        return self._counted('match', *args, **kwargs)
+
+    def fullmatch(self, *args, **kwargs):
+        return self._counted('fullmatch', *args, **kwargs)
+
+
+class Profiler:
+    """Collects cumulative time and calls of the wrapped functions.
+    Time of a function includes the functions it calls, folded stacks (for flame graphs)
+    contain only the time spent in the function itself, in microseconds.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.functions = {}
+        self.tags = {}
+        self.record_types = {}
+        self.tags_by_record_type = {}
+        self.regex = {}
+        self.folded = {}
+        # frames of the running wrapped functions: [name, start, time of the called wrapped functions]
+        self._stack = []
+        self._record_type = None
+
+    def wrap(self, function, name):
+        """Returns function that measures calls of 'function'"""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            previous_type = self._record_type
+            if name in RECORD_TYPES:
+                self._record_type = RECORD_TYPES[name]
+            frame = [name, time.perf_counter(), 0.0]
+            self._stack.append(frame)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - frame[1]
+                stack = ';'.join(f[0] for f in self._stack)
+                self._stack.pop()
+                if self._stack:
+                    self._stack[-1][2] += elapsed
+                self.folded[stack] = self.folded.get(stack, 0) + int((elapsed - frame[2]) * 1e6)
+                add_stat(self.functions, name, elapsed)
+                add_stat(self.tags, function_tag(name), elapsed)
+                if not self._record_type is None:
+                    add_stat(self.record_types.setdefault(self._record_type, {}), name, elapsed)
+                    add_stat(self.tags_by_record_type.setdefault(self._record_type, {}), function_tag(name), elapsed)
+                self._record_type = previous_type
+        wrapper.profiled = True
+        return wrapper
+
+    def instrument(self, module):
+        """Wraps all add_*, create_* and c_* functions defined in the module."""
+        for name, value in list(vars(module).items()):
+            if (name.startswith(PREFIXES) and callable(value) and not getattr(value, 'profiled', False)
+                    and getattr(value, '__module__', None) == module.__name__):
+                setattr(module, name, self.wrap(value, name))
+
+    def count_patterns(self, module):
+        """Counts calls and matches of all compiled patterns defined in the module (e.g. module parsing).
+        Memoized parsers use the patterns only for values they haven't seen yet."""
+        for name, value in list(vars(module).items()):
+            if isinstance(value, re.Pattern):
+                setattr(module, name, CountingPattern(self, value))
+
+    def count_regex(self, pattern, matched):
+        pattern = getattr(pattern, 'pattern', pattern)
+        stat = self.regex.setdefault(pattern, {'calls': 0, 'matches': 0})
+        stat['calls'] += 1
+        stat['matches'] += int(matched)
+
+    def snapshot(self):
+        """Returns collected statistics as a dictionary"""
+        return {'functions': self.functions,
+                'tags': self.tags,
+                'record_types': self.record_types,
+                'tags_by_record_type': self.tags_by_record_type,
+                'regex': self.regex,
+                'folded': self.folded}
+
+    def pop(self):
+        """Returns collected statistics and starts collecting again (used in worker processes)"""
+        snapshot = self.snapshot()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Adds statistics from another profiler (e.g. from a worker process)"""
+        for key, value in snapshot['functions'].items():
+            add_stat(self.functions, key, value['seconds'], value['calls'])
+        for key, value in snapshot['tags'].items():
+            add_stat(self.tags, key, value['seconds'], value['calls'])
+        for attribute in ['record_types', 'tags_by_record_type']:
+            for record_type, stats in snapshot[attribute].items():
+                for key, value in stats.items():
+                    add_stat(getattr(self, attribute).setdefault(record_type, {}), key, value['seconds'], value['calls'])
+        for pattern, value in snapshot['regex'].items():
+            stat = self.regex.setdefault(pattern, {'calls': 0, 'matches': 0})
+            stat['calls'] += value['calls']
+            stat['matches'] += value['matches']
+        for stack, microseconds in snapshot['folded'].items():
+            self.folded[stack] = self.folded.get(stack, 0) + microseconds
+
+    def dump_json(self, path):
+        snapshot = self.snapshot()
+        del snapshot['folded']
+        with open(path, 'w', encoding='utf_8') as out:
+            json.dump(snapshot, out, indent=2, ensure_ascii=False)
+
+    def dump_folded(self, path):
+        """Writes folded stacks 'function;function;function microseconds', input of flamegraph.pl or speedscope"""
+        with open(path, 'w', encoding='utf_8') as out:
+            for stack, microseconds in sorted(self.folded.items()):
+                out.write('%s %d\n' % (stack, microseconds))
@@ -0,0 +1,160 @@
+# -----------------------------------------------------------
+# Lightweight marc record builder used instead of pymarc when the records are created
+# Fields are collected in a list and sorted by tag once, leader, directory and data
+# are encoded straight to bytes (ISO 2709), byte for byte the same as pymarc's as_marc()
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+from operator import add
+
+LEADER_LENGTH = 24
+SUBFIELD_INDICATOR = '\x1f'
+END_OF_FIELD = '\x1e'
+END_OF_RECORD = b'\x1d'
+ENCODING = 'utf_8'
+
+def field_order(field):
+    """Sort key of the field, same order as pymarc's add_ordered_field:
+    numeric tags in ascending order, then other tags (e.g. OWN) in the order they were added"""
+    if field.tag.isdigit():
+        return (0, int(field.tag))
+    return (1, 0)
+
+
+class Field:
+    """Field of the record with the same arguments as pymarc.Field (subfields as list [code, value, code, value...]).
+    Control fields (tags 001-009) have data instead of indicators and subfields."""
+
+    __slots__ = ('tag', 'indicators', 'subfields', 'data')
+
+    def __init__(self, tag, indicators=None, subfields=None, data=''):
+        self.tag = tag
+        self.indicators = indicators
+        self.subfields = subfields
+        self.data = data
+
+    def is_control_field(self):
+        return self.tag < '010' and self.tag.isdigit()
+
+    def __iter__(self):
+        """Yields tuples (code, value) of the subfields"""
+        subfields = self.subfields or []
+        return zip(subfields[0::2], subfields[1::2])
+
+    def value(self):
+        """Returns content of the field as it is written to marc, without the end of field"""
+        if self.is_control_field():
+            return self.data
+        (indicator1, indicator2) = self.indicators
+        if not self.subfields:
+            return indicator1 + indicator2
+        # codes and values are joined pairwise in one pass over the list
+        subfields = self.subfields
+        return indicator1 + indicator2 + SUBFIELD_INDICATOR + SUBFIELD_INDICATOR.join(map(add, subfields[0::2], subfields[1::2]))
+
+    def __str__(self):
+        """Field in MARCMaker format, same as pymarc"""
+        if self.is_control_field():
+            return '=%s  %s' % (self.tag, self.data.replace(' ', '\\'))
+        indicators = ''.join('\\' if indicator in (' ', '\\') else indicator for indicator in self.indicators)
+        return '=%s  %s' % (self.tag, indicators) + ''.join('$%s%s' % subfield for subfield in self)
+
+
+class Record:
+    """Record collecting fields in the order they were added.
+    Fields are sorted only once, when the record is serialized."""
+
+    # buffers reused by all records, records are serialized one after another
+    _directory = bytearray()
+    _data = bytearray()
+
+    def __init__(self, leader=' ' * LEADER_LENGTH):
+        self.leader = leader
+        self._fields = []
+
+    def add_ordered_field(self, *fields):
+        """Adds fields to the record, they are ordered by tag in as_marc()"""
+        self._fields.extend(fields)
+
+    @property
+    def fields(self):
+        """Fields of the record ordered by tag"""
+        return sorted(self._fields, key=field_order)
+
+    def __getitem__(self, tag):
+        """Returns first field with the tag, None if the record doesn't have it"""
+        for field in self.fields:
+            if field.tag == tag:
+                return field
+        return None
+
+    def get_fields(self, *tags):
+        return [field for field in self.fields if field.tag in tags]
+
+    def as_marc(self):
+        """Returns the record serialized to marc (ISO 2709, UTF-8)"""
+        directory = self._directory
+        data = self._data
+        del directory[:]
+        del data[:]
+        for field in self.fields:
+            encoded = (field.value() + END_OF_FIELD).encode(ENCODING)
+            directory += b'%3s%04d%05d' % (field.tag.encode(ENCODING), len(encoded), len(data))
+            data += encoded
+        directory += END_OF_FIELD.encode(ENCODING)
+        data += END_OF_RECORD
+        # the base address where the directory ends and the field data begins
+        base_address = LEADER_LENGTH + len(directory)
+        leader = '%05d%s%05d%s' % (base_address + len(data), self.leader[5:12], base_address, self.leader[17:])
+        return leader.encode(ENCODING) + directory + data
+
+    def as_pymarc(self):
+        """Returns the same record as pymarc.Record (e.g. for writing other formats or verifying as_marc())"""
+        from pymarc import Record as PymarcRecord
+        from pymarc.field import Field as PymarcField
+        record = PymarcRecord(to_unicode=True, force_utf8=True)
+        record.leader = self.leader
+        for field in self._fields:
+            if field.is_control_field():
+                record.add_ordered_field(PymarcField(tag=field.tag, data=field.data))
+            else:
+                record.add_ordered_field(PymarcField(tag=field.tag, indicators=list(field.indicators), subfields=list(field.subfields)))
+        return record
+
+    def __str__(self):
+        """Record in MARCMaker format, same as pymarc"""
+        return '\n'.join(['=LDR  %s' % self.leader] + [str(field) for field in self.fields]) + '\n'
+
+def parse_marc(marc):
+    """Reads record serialized to marc by as_marc() back to Record (leader keeps the record length and base address)"""
+    leader = marc[:LEADER_LENGTH].decode(ENCODING)
+    base_address = int(leader[12:17])
+    record = Record(leader)
+    directory = marc[LEADER_LENGTH:base_address - 1]
+    for start in range(0, len(directory), 12):
+        entry = directory[start:start + 12]
+        tag = entry[:3].decode(ENCODING)
+        length = int(entry[3:7])
+        offset = base_address + int(entry[7:12])
+        # end of field is not part of the value
+        value = marc[offset:offset + length - 1].decode(ENCODING)
+        if tag < '010' and tag.isdigit():
+            record.add_ordered_field(Field(tag, data=value))
+        else:
+            subfields = []
+            for subfield in value[2:].split(SUBFIELD_INDICATOR)[1:]:
+                subfields += [subfield[:1], subfield[1:]]
+            record.add_ordered_field(Field(tag, indicators=[value[0], value[1]], subfields=subfields))
+    return record
+
+def control_field(marc, tag):
+    """Returns data of the control field (e.g. '001') read straight from the marc bytes,
+    other fields are not decoded. None if the record doesn't have the field."""
+    base_address = int(marc[12:17])
+    tag = tag.encode(ENCODING)
+    for start in range(LEADER_LENGTH, base_address - 1, 12):
+        if marc[start:start + 3] == tag:
+            length = int(marc[start + 3:start + 7])
+            offset = base_address + int(marc[start + 7:start + 12])
+            return marc[offset:offset + length - 1].decode(ENCODING)
+    return None
@@ -0,0 +1,72 @@
+# -----------------------------------------------------------
+# Cache of the converted records for incremental conversion
+# Keeps hash of every row together with its record serialized to marc,
+# so only new and changed rows are converted again
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import hashlib
+import sqlite3
+
+from parsing import isnull
+
+# version of the records, change it when the conversion changes, so all records are converted again
+RECORD_VERSION = '2'
+
+def row_hash(row):
+    """Returns hash of all values of the row"""
+    return hashlib.sha1(repr(tuple(row)).encode('utf_8')).hexdigest()
+
+def record_hashes(record_index):
+    """Returns list of hashes of all rows in record_index.
+    Hash of a record covers everything the record is made of:
+    part of the book also depends on the row of its collective work
+    and the collective work depends on the list of its parts (field 994)."""
+    own = [row_hash(row) for row in record_index.rows]
+    hashes = []
+    for position, row in enumerate(record_index.rows):
+        sha1 = hashlib.sha1((RECORD_VERSION + own[position]).encode('utf_8'))
+        if not isnull(row.part_of) and row.part_of in record_index.positions:
+            sha1.update(own[record_index.positions[row.part_of]].encode('utf_8'))
+        sha1.update(repr(record_index.parts(row.number)).encode('utf_8'))
+        hashes.append(sha1.hexdigest())
+    return hashes
+
+
+class RecordCache:
+    """Records serialized to marc, stored in SQLite by record number with the hash of their rows.
+    'dependencies' are strings (e.g. signatures of the lookup files), if any of them changes, the cache is emptied.
+    """
+
+    def __init__(self, path, dependencies=()):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS records (number TEXT PRIMARY KEY, hash TEXT, marc BLOB)')
+        dependencies = repr(list(dependencies))
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'dependencies'").fetchone()
+        if row is None or row[0] != dependencies:
+            with self.connection:
+                self.connection.execute('DELETE FROM records')
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('dependencies', ?)", (dependencies,))
+
+    def load(self):
+        """Returns dictionary record number: (hash, marc) of all cached records"""
+        return {number: (hash, marc) for (number, hash, marc) in self.connection.execute('SELECT number, hash, marc FROM records')}
+
+    def update(self, records):
+        """Saves tuples (record number, hash, marc) to the cache"""
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?)', records)
+
+    def prune(self, numbers):
+        """Deletes records whose numbers are not in numbers (rows deleted from the table)"""
+        numbers = set(numbers)
+        deleted = [(number,) for (number,) in self.connection.execute('SELECT number FROM records') if not number in numbers]
+        with self.connection:
+            self.connection.executemany('DELETE FROM records WHERE number = ?', deleted)
+        return len(deleted)
+
+    def close(self):
+        self.connection.close()
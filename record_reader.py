@@ -0,0 +1,105 @@
+# -----------------------------------------------------------
+# Random access to the converted records by their id (field 001, e.g. it22000123)
+# Uses the offset index written next to the marc file (--offset-index, --shard-records, --shard-size),
+# shards are memory mapped and only the requested record is read and decoded
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import argparse
+import mmap
+import os
+import sys
+
+from record_builder import parse_marc
+from sinks import INDEX_COLUMNS, INDEX_EXTENSION, index_path
+
+def read_index(path):
+    """Reads the offset index. Returns dictionary id: (shard, offset, length)."""
+    offsets = {}
+    with open(path, encoding='utf_8') as index:
+        header = index.readline().rstrip('\n').split('\t')
+        if header != INDEX_COLUMNS:
+            raise ValueError('%s is not an offset index, header is %r' % (path, header))
+        for line in index:
+            (id, shard, offset, length) = line.rstrip('\n').split('\t')
+            offsets[id] = (shard, int(offset), int(length))
+    return offsets
+
+
+class RecordReader:
+    """Reads records by id from the marc file or its shards.
+    'path' is the marc file (as given to --output) or its offset index.
+    Shards are mapped to memory when a record from them is read for the first time."""
+
+    def __init__(self, path):
+        if not path.endswith(INDEX_EXTENSION):
+            path = index_path(path)
+        self.index_path = path
+        self.directory = os.path.dirname(path)
+        self.offsets = read_index(path)
+        # shard: (file, memory map)
+        self._maps = {}
+
+    def _map(self, shard):
+        if not shard in self._maps:
+            file = open(os.path.join(self.directory, shard), 'rb')
+            self._maps[shard] = (file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._maps[shard][1]
+
+    def get_marc(self, id):
+        """Returns the record serialized to marc, raises KeyError if the id is not in the index"""
+        (shard, offset, length) = self.offsets[id]
+        marc = self._map(shard)[offset:offset + length]
+        # record length in the leader, differs if the shard was rewritten after the index
+        if len(marc) != length or marc[:5] != b'%05d' % length:
+            raise ValueError('Record %s is not at offset %d of %s, index is out of date' % (id, offset, shard))
+        return marc
+
+    def get_record(self, id):
+        """Returns the record as record_builder.Record"""
+        return parse_marc(self.get_marc(id))
+
+    def __contains__(self, id):
+        return id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def ids(self):
+        return iter(self.offsets)
+
+    def close(self):
+        for (file, memory_map) in self._maps.values():
+            memory_map.close()
+            file.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints records of the converted marc file by their id (field 001)')
+    parser.add_argument('path', help='marc file or its offset index (' + INDEX_EXTENSION + ')')
+    parser.add_argument('ids', nargs='+', metavar='id', help='id of the record, e.g. it22000123')
+    parser.add_argument('--raw', action='store_true', help='write records as binary marc instead of MARCMaker text')
+    args = parser.parse_args()
+    path = args.path if args.path.endswith(INDEX_EXTENSION) else index_path(args.path)
+    if not os.path.exists(path):
+        parser.exit(1, 'Offset index %s not found, write it with --offset-index or --shard-records/--shard-size\n' % path)
+    missing = 0
+    with RecordReader(path) as reader:
+        for id in args.ids:
+            if not id in reader:
+                print('Record %s is not in the index' % id, file=sys.stderr)
+                missing += 1
+            elif args.raw:
+                sys.stdout.buffer.write(reader.get_marc(id))
+            else:
+                print(reader.get_record(id))
+    parser.exit(1 if missing else 0)
+
+if __name__ == '__main__':
+    main()
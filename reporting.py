@@ -0,0 +1,70 @@
+# -----------------------------------------------------------
+# Logging and progress reporting of the conversion
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import logging
+import time
+
+# log format of all scripts
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+# seconds between two progress messages
+PROGRESS_INTERVAL = 5
+
+def add_logging_arguments(parser):
+    """Adds --verbose and --quiet to the command line arguments"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--verbose', '-v', action='store_true',
+                       help='log every converted record (slow, only for debugging)')
+    group.add_argument('--quiet', '-q', action='store_true',
+                       help='log only warnings and errors')
+
+def logging_level(args):
+    """Returns logging level chosen by the command line arguments"""
+    if args.verbose:
+        return logging.DEBUG
+    if args.quiet:
+        return logging.WARNING
+    return logging.INFO
+
+def setup_logging(level):
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+class Progress:
+    """Logs number of converted rows, speed in rows per second and estimated time to the end.
+    Message is logged at most once in 'interval' seconds. 'total' is None if the number of rows is unknown.
+    """
+
+    def __init__(self, total, log, interval=PROGRESS_INTERVAL, unit='rows'):
+        self.total = total
+        self.log = log
+        self.interval = interval
+        self.unit = unit
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, count=1):
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            rate = self.rate()
+            if self.total is None:
+                # total is unknown (e.g. streamed table), no ETA
+                self.log.info('%d %s (%.0f %s/s)', self.done, self.unit, rate, self.unit)
+                return
+            if rate > 0:
+                eta = time.strftime('%H:%M:%S', time.gmtime((self.total - self.done) / rate))
+            else:
+                eta = '?'
+            self.log.info('%d/%d %s (%.0f %s/s, ETA %s)', self.done, self.total, self.unit, rate, self.unit, eta)
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        self.log.info('%d %s in %.1f s (%.0f %s/s)', self.done, self.unit, elapsed, self.rate(), self.unit)
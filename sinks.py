@@ -0,0 +1,319 @@
+# -----------------------------------------------------------
+# Output sinks of the converted records
+# Every record is written to all chosen formats (binary marc, MARCXML, JSON lines)
+# in one pass, record by record, optionally compressed with gzip
+# Outputs are written to temporary files and renamed when all records are written,
+# so a failed run never leaves a truncated file
+# Binary marc can be split to shards with an index of the records' byte offsets (see record_reader)
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import gzip
+import json
+import logging
+import os
+
+from record_builder import control_field, parse_marc
+
+log = logging.getLogger(__name__)
+
+# size of the output file buffer, records are written in large blocks
+WRITE_BUFFER = 1 << 20
+MARCXML_NAMESPACE = 'http://www.loc.gov/MARC21/slim'
+# extension of the offset index written next to the marc file
+INDEX_EXTENSION = '.idx.tsv'
+# columns of the offset index
+INDEX_COLUMNS = ['id', 'shard', 'offset', 'length']
+# encoder of the JSON lines, records are plain dictionaries and lists
+json_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False)
+
+def open_output(path, compress=False):
+    """Opens binary output file, compressed with gzip if compress is True"""
+    if compress:
+        return gzip.open(path, 'wb', compresslevel=6)
+    return open(path, 'wb', buffering=WRITE_BUFFER)
+
+def escape(value):
+    """Escapes characters with special meaning in XML text and attributes"""
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    return value
+
+def record_to_xml(record):
+    """Returns record as MARCXML element <record> on one line"""
+    parts = ['<record><leader>', escape(record.leader), '</leader>']
+    for field in record.fields:
+        if field.is_control_field():
+            parts += ('<controlfield tag="', field.tag, '">', escape(field.data), '</controlfield>')
+        else:
+            parts += ('<datafield tag="', field.tag, '" ind1="', escape(field.indicators[0]),
+                      '" ind2="', escape(field.indicators[1]), '">')
+            for code, value in field:
+                parts += ('<subfield code="', escape(code), '">', escape(value), '</subfield>')
+            parts.append('</datafield>')
+    parts.append('</record>\n')
+    return ''.join(parts)
+
+def record_to_json(record):
+    """Returns record in MARC-in-JSON format (same structure as pymarc's as_json()) on one line"""
+    fields = []
+    for field in record.fields:
+        if field.is_control_field():
+            fields.append({field.tag: field.data})
+        else:
+            fields.append({field.tag: {'ind1': field.indicators[0],
+                                       'ind2': field.indicators[1],
+                                       'subfields': [{code: value} for code, value in field]}})
+    return json_encoder.encode({'leader': record.leader, 'fields': fields}) + '\n'
+
+class MarcSink:
+    """Binary marc (ISO 2709), records are written as they were serialized"""
+
+    extension = '.mrc'
+    # records are written as marc bytes, they don't have to be decoded
+    decode = False
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.tmp_path = path + '.%d.tmp' % os.getpid()
+        self.file = open_output(self.tmp_path, compress)
+
+    def write(self, marc, record=None):
+        self.file.write(marc)
+
+    def close(self):
+        """Finishes the file and renames it to its path"""
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        """Deletes the unfinished file, the file in path stays as it was"""
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class XmlSink(MarcSink):
+    """MARCXML collection, one record per line"""
+
+    extension = '.xml'
+    decode = True
+
+    def __init__(self, path, compress=False):
+        super().__init__(path, compress)
+        self.file.write(('<?xml version="1.0" encoding="UTF-8"?>\n<collection xmlns="%s">\n' % MARCXML_NAMESPACE).encode('utf_8'))
+
+    def write(self, marc, record=None):
+        self.file.write(record_to_xml(record).encode('utf_8'))
+
+    def close(self):
+        self.file.write(b'</collection>\n')
+        super().close()
+
+
+class JsonSink(MarcSink):
+    """JSON lines, one record in MARC-in-JSON format per line"""
+
+    extension = '.jsonl'
+    decode = True
+
+    def write(self, marc, record=None):
+        self.file.write(record_to_json(record).encode('utf_8'))
+
+
+def shard_path(path, number):
+    """Returns path of the shard, e.g. marc_it.0001.mrc for marc_it.mrc"""
+    (stem, extension) = os.path.splitext(path)
+    return '%s.%04d%s' % (stem, number, extension)
+
+def index_path(path):
+    """Returns path of the offset index of the marc file, e.g. marc_it.idx.tsv for marc_it.mrc"""
+    return os.path.splitext(path)[0] + INDEX_EXTENSION
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def remove_shards(path, first=1):
+    """Deletes shards of the marc file numbered from 'first' on, left from an earlier run"""
+    number = first
+    while os.path.exists(shard_path(path, number)):
+        os.remove(shard_path(path, number))
+        number += 1
+
+def remove_stale_outputs(path, indexed=False, sharded=False):
+    """Deletes outputs of earlier runs that don't belong to this run's marc file in path,
+    so the offset index never points to records of an older run:
+    the index and shards of a file written without them and the single file replaced by shards."""
+    if not indexed:
+        remove_file(index_path(path))
+    if sharded:
+        remove_file(path)
+    else:
+        remove_shards(path)
+
+
+class IndexedMarcSink:
+    """Binary marc with the offset index of the records (columns INDEX_COLUMNS, id is field 001).
+    Records are split to shards of at most 'shard_records' records and 'shard_size' bytes,
+    without the limits they are written to one file (path) and only the index is added.
+    Offset is the byte position of the record in its shard, shard is the file name."""
+
+    extension = '.mrc'
+    decode = False
+
+    def __init__(self, path, shard_records=None, shard_size=None):
+        self.path = path
+        self.shard_records = shard_records
+        self.shard_size = shard_size
+        self.sharded = not (shard_records is None and shard_size is None)
+        self.shards = []
+        # records and bytes written to the last shard
+        self.records = 0
+        self.offset = 0
+        self.index_path = index_path(path)
+        self.index_tmp_path = self.index_path + '.%d.tmp' % os.getpid()
+        self.index = open(self.index_tmp_path, 'w', encoding='utf_8', newline='\n', buffering=WRITE_BUFFER)
+        self.index.write('\t'.join(INDEX_COLUMNS) + '\n')
+
+    def _is_full(self, size):
+        if not self.shards:
+            return True
+        if self.records == 0:
+            return False
+        if not self.shard_records is None and self.records >= self.shard_records:
+            return True
+        return not self.shard_size is None and self.offset + size > self.shard_size
+
+    def _next_shard(self):
+        if self.shards:
+            # finished shard is closed now and renamed with the others in close()
+            self.shards[-1].file.close()
+        path = shard_path(self.path, len(self.shards) + 1) if self.sharded else self.path
+        self.shards.append(MarcSink(path))
+        self.records = 0
+        self.offset = 0
+
+    def write(self, marc, record=None):
+        if self._is_full(len(marc)):
+            self._next_shard()
+        shard = self.shards[-1]
+        shard.file.write(marc)
+        id = control_field(marc, '001')
+        if id is None:
+            log.warning('Record without field 001 is left out of the offset index')
+        else:
+            self.index.write('%s\t%s\t%d\t%d\n' % (id, os.path.basename(shard.path), self.offset, len(marc)))
+        self.records += 1
+        self.offset += len(marc)
+
+    def close(self):
+        """Renames all shards, then the index, and deletes files left from an earlier run
+        (shards beyond the last one, single file replaced by shards or shards replaced by single file)"""
+        if not self.shards:
+            # index of an empty output points to an empty file
+            self._next_shard()
+        for shard in self.shards:
+            shard.close()
+        self.index.close()
+        os.replace(self.index_tmp_path, self.index_path)
+        if self.sharded:
+            remove_shards(self.path, len(self.shards) + 1)
+        remove_stale_outputs(self.path, indexed=True, sharded=self.sharded)
+
+    def discard(self):
+        for shard in self.shards:
+            shard.discard()
+        self.index.close()
+        os.remove(self.index_tmp_path)
+
+
+# format name used on the command line: sink
+SINKS = {'marc': MarcSink, 'xml': XmlSink, 'json': JsonSink}
+
+def add_sharding_arguments(parser):
+    """Adds --shard-records, --shard-size and --offset-index to the command line arguments"""
+    parser.add_argument('--shard-records', type=int, default=None, metavar='N',
+                        help='split the marc file to shards of at most N records, with the offset index')
+    parser.add_argument('--shard-size', type=float, default=None, metavar='MB',
+                        help='split the marc file to shards of at most MB megabytes, with the offset index')
+    parser.add_argument('--offset-index', action='store_true',
+                        help='write index of the records by field 001 (' + INDEX_EXTENSION + ') next to the marc file')
+
+def sharding_options(parser, args):
+    """Returns keyword arguments of Sinks chosen by the arguments from add_sharding_arguments()"""
+    shard_size = None if args.shard_size is None else int(args.shard_size * (1 << 20))
+    if args.gzip and (args.offset_index or not (args.shard_records is None and shard_size is None)):
+        parser.error('--gzip can\'t be combined with --shard-records, --shard-size and --offset-index')
+    return {'shard_records': args.shard_records, 'shard_size': shard_size, 'offset_index': args.offset_index}
+
+def output_paths(path, formats, compress=False):
+    """Returns dictionary format: path of the output file.
+    Binary marc is written to path, other formats to the same name with their extension."""
+    stem = os.path.splitext(path)[0]
+    suffix = '.gz' if compress else ''
+    paths = {}
+    for name in formats:
+        if name == 'marc':
+            paths[name] = path + suffix
+        else:
+            paths[name] = stem + SINKS[name].extension + suffix
+    return paths
+
+
+class Sinks:
+    """Writes every record to all chosen formats.
+    Records come serialized to marc (also the ones from the cache in incremental mode),
+    other formats are created from the same bytes, so all outputs contain the same records."""
+
+    def __init__(self, path, formats=('marc',), compress=False, shard_records=None, shard_size=None, offset_index=False):
+        """Binary marc is split to shards (see IndexedMarcSink) if shard_records or shard_size is given,
+        the offset index is written also if offset_index is True."""
+        self.path = path
+        self.indexed = offset_index or not (shard_records is None and shard_size is None)
+        if self.indexed and compress:
+            raise ValueError("Compressed marc can't be read by byte offsets, sharding and offset index need uncompressed output")
+        self.paths = output_paths(path, formats, compress)
+        self.sinks = []
+        try:
+            for name, sink_path in self.paths.items():
+                if name == 'marc' and self.indexed:
+                    self.sinks.append(IndexedMarcSink(sink_path, shard_records, shard_size))
+                else:
+                    self.sinks.append(SINKS[name](sink_path, compress))
+        except Exception:
+            self.discard()
+            raise
+        # record is decoded from marc only if some format needs it
+        self.decode = any(sink.decode for sink in self.sinks)
+
+    def write(self, marc):
+        record = parse_marc(marc) if self.decode else None
+        for sink in self.sinks:
+            sink.write(marc, record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        if 'marc' in self.paths and not self.indexed:
+            # index and shards of an earlier run would point to older records
+            remove_stale_outputs(self.path)
+
+    def discard(self):
+        for sink in self.sinks:
+            sink.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # outputs of a failed run are deleted
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,122 @@
+# -----------------------------------------------------------
+# Validation of the normalized table before the records are created
+# All rows are checked at once with pandas column operations,
+# every problem is reported with its record number and column,
+# rows with errors are skipped or written to a quarantine file
+# Written for the ČLB ÚČL AV ČR
+# -----------------------------------------------------------
+
+import logging
+import os
+
+import pandas as pd
+
+from normalization import ROW_FIELDS
+
+log = logging.getLogger(__name__)
+
+# row can't be converted, it is skipped
+ERROR = 'error'
+# row is converted, but its record misses some data
+WARNING = 'warning'
+
+# record types the converter creates records for
+RECORD_TYPES = ['kniha', 'část knihy', 'článek v časopise']
+
+# columns of the problems returned by validate()
+PROBLEM_COLUMNS = ['number', 'column', 'severity', 'problem']
+
+def contains(column, text):
+    """True for cells containing text, False for empty cells"""
+    return column.str.contains(text, regex=False, na=False).astype(bool)
+
+def has_none(column):
+    """True for cells with a tuple containing None (e.g. publisher that couldn't be parsed), False for empty cells"""
+    return column.map(lambda values: values is not None and None in values).astype(bool)
+
+def not_whole_number(column):
+    """True for filled cells that are not whole numbers"""
+    numbers = pd.to_numeric(column, errors='coerce')
+    return column.notna() & (numbers.isna() | (numbers % 1 != 0))
+
+def checks(df, whole_table=True):
+    """Checks of the table with columns named as the fields of TableRow.
+    Yields tuples (column, severity, problem, mask of the rows with the problem).
+    If whole_table is False (batch of a streamed table), collective works are not looked up in df."""
+    record_type = df['record_type']
+    is_book = contains(record_type, 'kniha')
+    is_part = contains(record_type, 'část knihy')
+    is_article = contains(record_type, 'článek v časopise')
+    yield ('Typ záznamu', ERROR, 'unknown record type', ~(is_book | is_part | is_article))
+    yield ('Název díla dle titulu (v příslušném písmu)', ERROR, 'missing title', df['title'].isna() | (df['title'] == ''))
+    # code in parentheses without the name before it, e.g. 'Surname, Name(code)'
+    yield ('Autor/ka + kód autority', ERROR, "author couldn't be parsed, expected 'Surname, Name (code)'",
+           df['author'].isna() & df['author_code'].notna())
+    yield ('Autor/ka + kód autority', WARNING, 'author without comma, author is left out of field 245',
+           df['author'].notna() & df['author_natural'].isna())
+    # year is used in fields 264 and 773, parts of books take year and publication from their collective work
+    yield ('Rok', ERROR, 'missing year', ~is_part & df['year'].isna() & (df['publication'].notna() | is_article))
+    yield ('Rok', ERROR, 'year is not a whole number', ~is_part & not_whole_number(df['year']))
+    yield ('Město vydání, země vydání, nakladatel', ERROR, "publisher without ': '", ~is_part & has_none(df['publishers']))
+    yield ('Město vydání, země vydání, nakladatel', ERROR, 'missing city', ~is_part & has_none(df['cities']))
+    yield ('Údaje o časopiseckém vydání', ERROR, 'missing magazine issue', is_article & df['magazine_issue'].isna())
+    yield ('Údaje o časopiseckém vydání', WARNING, 'magazine issue without comma, field 773 is left out',
+           is_article & df['magazine_issue'].notna() & ~contains(df['magazine_issue'], ','))
+    yield ('Je součást čeho (číslo záznamu)', ERROR, 'missing collective work', is_part & df['part_of'].isna())
+    yield ('Je součást čeho (číslo záznamu)', ERROR, 'collective work is not a whole number', not_whole_number(df['part_of']))
+    if whole_table:
+        yield ('Je součást čeho (číslo záznamu)', ERROR, 'collective work is not in the table',
+               is_part & df['part_of'].notna() & ~df['part_of'].isin(df['number']))
+    yield ('Překladatel/ka', WARNING, "translator without comma, translators are left out of field 245",
+           df['translators'].notna() & df['translators_natural'].isna())
+
+def validate(df, whole_table=True):
+    """Checks all rows of the normalized table (see checks()).
+    Returns DataFrame with one row for every problem (PROBLEM_COLUMNS), indexed by the rows of df.
+    Parts of the collective works with errors get an error too."""
+    # columns are named as the fields of TableRow
+    df = df[list(ROW_FIELDS)].set_axis(list(ROW_FIELDS.values()), axis=1)
+    found = []
+    for (column, severity, problem, mask) in checks(df, whole_table):
+        rows = df.index[mask.to_numpy()]
+        found.append(pd.DataFrame({'number': df.loc[rows, 'number'], 'column': column,
+                                   'severity': severity, 'problem': problem}, index=rows, columns=PROBLEM_COLUMNS))
+    problems = pd.concat(found)
+    # part of the book is created from the row of its collective work
+    invalid_books = problems.loc[problems['severity'] == ERROR, 'number']
+    mask = contains(df['record_type'], 'část knihy') & df['part_of'].isin(invalid_books)
+    rows = df.index[mask.to_numpy()]
+    problems = pd.concat([problems, pd.DataFrame({'number': df.loc[rows, 'number'], 'column': 'Je součást čeho (číslo záznamu)',
+                                                  'severity': ERROR, 'problem': 'collective work has errors'},
+                                                 index=rows, columns=PROBLEM_COLUMNS)])
+    return problems.sort_index(kind='stable')
+
+def invalid_rows(problems):
+    """Returns index of the rows with errors"""
+    return problems.index[problems['severity'] == ERROR].unique()
+
+def report(problems, summary=True):
+    """Logs every problem and the number of rows with errors and warnings (if summary is True)"""
+    for (number, column, severity, problem) in problems.itertuples(index=False, name=None):
+        level = logging.ERROR if severity == ERROR else logging.WARNING
+        log.log(level, 'Record %s, column %r: %s', number, column, problem)
+    if not summary:
+        return
+    errors = len(invalid_rows(problems))
+    warnings = problems.index[problems['severity'] == WARNING].nunique()
+    log.info('Validation: %d rows with errors, %d rows with warnings', errors, warnings)
+
+def write_quarantine(df, problems, columns, path, append=False):
+    """Writes rows with errors (their 'columns') with the list of problems to the CSV file.
+    File is written to a temporary file and renamed, unless rows are appended to it."""
+    rows = invalid_rows(problems)
+    quarantined = df.loc[rows, columns].copy()
+    errors = problems[problems['severity'] == ERROR]
+    quarantined['problems'] = (errors['column'] + ': ' + errors['problem']).groupby(level=0).agg('; '.join)
+    if append:
+        quarantined.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+        return len(rows)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    quarantined.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return len(rows)